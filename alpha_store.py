@@ -0,0 +1,268 @@
+"""
+Alpha 详情与 PnL 序列的批量获取与本地存储
+
+AlphaFetcher 使用连接池并发获取多个 alpha 的详情 (/alphas/{id}) 和
+每日 PnL 记录集 (/alphas/{id}/recordsets/pnl)，限流与重试由 request_policy 统一处理。
+
+AlphaStore 以追加写入的二进制文件保存 PnL 序列：
+
+    <store>/pnl.bin        所有 alpha 的 (日期, pnl) 记录依次追加，定长结构
+    <store>/index.jsonl    每个 alpha 一行: alpha_id、记录偏移、记录数、获取时间
+    <store>/details.jsonl  每个 alpha 一行: 完整的 alpha 详情 JSON
+
+读取时 pnl.bin 以 memmap 方式映射，对上千个 alpha 做相关性等分析无需重复联网。
+"""
+
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from profiling import span, traced
+from request_policy import _parse_retry_after, get_policy
+
+API_BASE = 'https://api.worldquantbrain.com'
+
+# 单条 PnL 记录: 日期（距 1970-01-01 的天数）+ 累计 PnL
+PNL_DTYPE = np.dtype([('date', '<i4'), ('pnl', '<f8')])
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def _date_to_days(value: str) -> int:
+    return (datetime.date.fromisoformat(value[:10]) - _EPOCH).days
+
+
+def days_to_date(days: int) -> str:
+    """将存储中的日期整数转换为 YYYY-MM-DD"""
+    return (_EPOCH + datetime.timedelta(days=int(days))).isoformat()
+
+
+def _append_line(path: str, line: str) -> None:
+    # 上次写入中断时文件可能以残缺行结尾，先补换行，避免新行与残缺行连在一起
+    with open(path, 'ab') as f:
+        if f.tell() > 0:
+            with open(path, 'rb') as tail:
+                tail.seek(-1, os.SEEK_END)
+                if tail.read(1) != b'\n':
+                    f.write(b'\n')
+        f.write(line.encode('utf-8') + b'\n')
+
+
+class AlphaStore:
+    """追加写入的 alpha PnL 时间序列存储"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.pnl_path = os.path.join(path, 'pnl.bin')
+        self.index_path = os.path.join(path, 'index.jsonl')
+        self.details_path = os.path.join(path, 'details.jsonl')
+        # alpha_id -> (记录偏移, 记录数)；同一 alpha 重复写入时以最后一次为准
+        self.index: Dict[str, Tuple[int, int]] = {}
+        self._records: Optional[np.ndarray] = None
+        self._load_index()
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 写入中断留下的残缺行
+                    continue
+                self.index[entry['alpha_id']] = (entry['offset'], entry['length'])
+
+    def __contains__(self, alpha_id: object) -> bool:
+        return alpha_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def append(self, alpha_id: str, records: np.ndarray, details: Optional[Dict[str, Any]] = None) -> None:
+        """追加一个 alpha 的 PnL 记录（PNL_DTYPE 结构数组）和详情"""
+        records = np.ascontiguousarray(records, dtype=PNL_DTYPE)
+        self._records = None
+        with open(self.pnl_path, 'ab') as f:
+            # 截掉上次写入中断留下的未索引数据（可能是半条记录），保证新记录按定长对齐
+            offset = max((o + n for o, n in self.index.values()), default=0)
+            if os.fstat(f.fileno()).st_size > offset * PNL_DTYPE.itemsize:
+                f.truncate(offset * PNL_DTYPE.itemsize)
+            f.write(records.tobytes())
+        if details is not None:
+            _append_line(self.details_path, json.dumps(details, ensure_ascii=False, default=str))
+        # 索引最后写入：索引中出现的条目，其数据一定已经落盘
+        _append_line(self.index_path, json.dumps({
+            'alpha_id': alpha_id,
+            'offset': offset,
+            'length': len(records),
+            'fetched_at': int(time.time()),
+        }))
+        self.index[alpha_id] = (offset, len(records))
+
+    def _mapped(self) -> np.ndarray:
+        if self._records is None:
+            if not os.path.exists(self.pnl_path) or os.path.getsize(self.pnl_path) == 0:
+                return np.empty(0, dtype=PNL_DTYPE)
+            count = os.path.getsize(self.pnl_path) // PNL_DTYPE.itemsize
+            self._records = np.memmap(self.pnl_path, dtype=PNL_DTYPE, mode='r', shape=(count,))
+        return self._records
+
+    def get_pnl(self, alpha_id: str) -> np.ndarray:
+        """返回某个 alpha 的 PnL 记录（只读视图）"""
+        offset, length = self.index[alpha_id]
+        return self._mapped()[offset:offset + length]
+
+    def get_details(self, alpha_ids: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """读取已保存的 alpha 详情"""
+        wanted = set(alpha_ids) if alpha_ids is not None else None
+        details: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self.details_path):
+            return details
+        with open(self.details_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                alpha_id = item.get('id')
+                if alpha_id and (wanted is None or alpha_id in wanted):
+                    details[alpha_id] = item
+        return details
+
+    def pnl_matrix(self, alpha_ids: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """将多个 alpha 的累计 PnL 按日期对齐
+
+        Returns:
+            (日期数组, (日期, alpha) 的 PnL 矩阵)，缺失值为 NaN
+        """
+        alpha_ids = list(alpha_ids)
+        series = [self.get_pnl(a) for a in alpha_ids]
+        if not series:
+            return np.empty(0, dtype=np.int32), np.empty((0, 0))
+        dates = np.unique(np.concatenate([s['date'] for s in series]))
+        matrix = np.full((len(dates), len(series)), np.nan)
+        for j, s in enumerate(series):
+            matrix[np.searchsorted(dates, s['date']), j] = s['pnl']
+        return dates, matrix
+
+    def correlation(self, alpha_ids: Iterable[str]) -> np.ndarray:
+        """计算多个 alpha 每日 PnL 变动的相关系数矩阵"""
+        _, matrix = self.pnl_matrix(alpha_ids)
+        daily = np.diff(matrix, axis=0)
+        daily = daily[~np.isnan(daily).any(axis=1)]
+        if daily.shape[0] < 2:
+            return np.full((matrix.shape[1], matrix.shape[1]), np.nan)
+        return np.corrcoef(daily, rowvar=False)
+
+
+def parse_pnl_recordset(data: Dict[str, Any]) -> np.ndarray:
+    """解析 PnL 记录集 JSON 为 PNL_DTYPE 结构数组"""
+    properties = data.get('schema', {}).get('properties', [])
+    names = [p.get('name') for p in properties]
+    date_idx = names.index('date') if 'date' in names else 0
+    pnl_idx = names.index('pnl') if 'pnl' in names else 1
+    records = data.get('records', [])
+    out = np.empty(len(records), dtype=PNL_DTYPE)
+    for i, record in enumerate(records):
+        out[i] = (_date_to_days(record[date_idx]), record[pnl_idx])
+    return out
+
+
+class AlphaFetcher:
+    """并发获取 alpha 详情与 PnL 记录集"""
+
+    def __init__(self, sess: requests.Session, workers: int = 8, poll_timeout: float = 300):
+        self.workers = workers
+        self.poll_timeout = poll_timeout
+        self.policy = get_policy('alphas')
+        # 使用独立的会话，沿用调用方的认证信息，不改动调用方会话的连接池配置
+        self.sess = requests.Session()
+        self.sess.auth = sess.auth
+        self.sess.headers.update(sess.headers)
+        self.sess.cookies.update(sess.cookies)
+        # 连接池大小与并发线程数一致，避免连接被反复创建
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.sess.mount('https://', adapter)
+
+    def close(self) -> None:
+        self.sess.close()
+
+    def __enter__(self) -> "AlphaFetcher":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _get_json(self, url: str, stage: str) -> Dict[str, Any]:
+        # 记录集尚在生成时，平台返回空内容和 Retry-After，需要轮询等待；stage 为剖析中的阶段名
+        deadline = time.time() + self.poll_timeout
+        while True:
+            with span(stage):
+                resp = self.policy.call(self.sess.get, url)
+            resp.raise_for_status()
+            # Retry-After 可能是秒数，也可能是 HTTP 日期
+            retry_after_sec = _parse_retry_after(resp.headers.get('Retry-After')) or 0
+            if retry_after_sec == 0 and resp.content:
+                return resp.json()
+            if time.time() > deadline:
+                raise TimeoutError(f"等待记录集超时: {url}")
+            with span('sleep', seconds=retry_after_sec or 1):
+                time.sleep(retry_after_sec or 1)
+
+    def fetch_one(self, alpha_id: str) -> Tuple[Dict[str, Any], np.ndarray]:
+        """获取单个 alpha 的详情和 PnL 记录"""
+        details = self._get_json(f"{API_BASE}/alphas/{alpha_id}", 'fetch')
+        pnl = parse_pnl_recordset(self._get_json(f"{API_BASE}/alphas/{alpha_id}/recordsets/pnl", 'fetch_pnl'))
+        return details, pnl
+
+    def fetch_many(self, alpha_ids: Iterable[str], store: AlphaStore,
+                   skip_existing: bool = True) -> Dict[str, str]:
+        """并发获取多个 alpha 并写入存储
+
+        Returns:
+            获取失败的 alpha_id -> 错误信息
+        """
+        pending = [a for a in dict.fromkeys(alpha_ids) if not (skip_existing and a in store)]
+        errors: Dict[str, str] = {}
+        if not pending:
+            return errors
+
+        print(f"📥 正在获取 {len(pending)} 个Alpha的详情与PnL序列...")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fetch_one, a): a for a in pending}
+            for future in as_completed(futures):
+                alpha_id = futures[future]
+                try:
+                    details, pnl = future.result()
+                except Exception as e:
+                    errors[alpha_id] = str(e)
+                    continue
+                # 只在主线程写入，保证追加顺序与索引一致
+                store.append(alpha_id, pnl, details)
+
+        print(f"✅ 获取完成: 成功 {len(pending) - len(errors)} 个, 失败 {len(errors)} 个")
+        return errors
+
+
+@traced('fetch_history')
+def fetch_alpha_history(sess: requests.Session, alpha_ids: Iterable[str],
+                        store_path: str = './log/alpha_store', workers: int = 8) -> AlphaStore:
+    """获取一组 alpha 的详情与 PnL 序列并返回本地存储"""
+    store = AlphaStore(store_path)
+    with AlphaFetcher(sess, workers=workers) as fetcher:
+        errors = fetcher.fetch_many(alpha_ids, store)
+    for alpha_id, error in errors.items():
+        print(f"  ❌ {alpha_id}: {error}")
+    return store
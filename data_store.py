@@ -0,0 +1,174 @@
+"""
+本地行情数据存储
+
+将原始行情数据（CSV 或长表 DataFrame）一次性转换为按字段分列的
+float32 内存映射文件，供本地因子评估使用：
+
+    <store>/meta.json        日期索引、股票索引、字段描述、分组编码表
+    <store>/close.bin        (日期, 股票) 的 float32 矩阵，C 顺序
+    <store>/subindustry.bin  (日期, 股票) 的 int32 分组编码，缺失为 -1
+    ...
+
+打开存储只读取 meta.json；字段在第一次被引用时才以只读 memmap 方式映射，
+因此只有因子表达式实际用到的字段会被分页载入，内存占用与所用字段数成正比。
+"""
+
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+
+# 分组字段以整数编码存储，供 group_neutralize 等分组函数使用
+GROUP_FIELDS = ("sector", "industry", "subindustry")
+
+META_FILE = "meta.json"
+
+
+class PanelStore(Mapping[str, np.ndarray]):
+    """只读的内存映射行情面板
+
+    以字段名索引即可得到 (日期, 股票) 的 numpy memmap，
+    可直接作为 local_evaluator 中的 panels 使用。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != STORE_VERSION:
+            raise ValueError(f"不支持的数据存储版本: {meta.get('version')}")
+        self.dates: List[str] = meta['dates']
+        self.instruments: List[str] = meta['instruments']
+        self.field_meta: Dict[str, Dict[str, Any]] = meta['fields']
+        self.group_labels: Dict[str, List[str]] = meta.get('groups', {})
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.dates), len(self.instruments))
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        array = self._arrays.get(name)
+        if array is None:
+            info = self.field_meta[name]
+            array = np.memmap(
+                os.path.join(self.path, info['file']),
+                dtype=np.dtype(info['dtype']),
+                mode='r',
+                shape=self.shape,
+            )
+            self._arrays[name] = array
+        return array
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.field_meta
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.field_meta)
+
+    def __len__(self) -> int:
+        return len(self.field_meta)
+
+    @property
+    def loaded_fields(self) -> List[str]:
+        """已被映射的字段"""
+        return list(self._arrays)
+
+    def fields_for(self, expression: str) -> List[str]:
+        """返回因子表达式引用、且存储中存在的字段"""
+        from local_evaluator import expression_fields
+
+        return sorted(f for f in expression_fields(expression) if f in self.field_meta)
+
+    def load(self, expression: str) -> Dict[str, np.ndarray]:
+        """只映射因子表达式实际引用的字段"""
+        return {name: self[name] for name in self.fields_for(expression)}
+
+    def close(self) -> None:
+        """释放已映射的字段"""
+        self._arrays.clear()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # 跨进程传递时只携带元数据，字段在目标进程中重新映射
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+
+def build_panel_store(path: str, frame: pd.DataFrame, fields: Optional[Sequence[str]] = None,
+                      date_column: str = 'date', instrument_column: str = 'instrument',
+                      group_fields: Iterable[str] = GROUP_FIELDS) -> PanelStore:
+    """将长表行情数据（每行一个 日期-股票）转换为内存映射存储
+
+    Args:
+        path: 存储目录
+        frame: 至少包含日期列、股票列和若干字段列的 DataFrame
+        fields: 要转换的字段，默认为除日期、股票列外的全部列
+        group_fields: 以整数编码存储的分组字段
+    """
+    if fields is None:
+        fields = [c for c in frame.columns if c not in (date_column, instrument_column)]
+    group_fields = set(group_fields)
+
+    frame = frame.set_index([date_column, instrument_column]).sort_index()
+    if not frame.index.is_unique:
+        raise ValueError("存在重复的 日期-股票 记录")
+    dates = frame.index.get_level_values(0).unique()
+    instruments = frame.index.get_level_values(1).unique().sort_values()
+    full_index = pd.MultiIndex.from_product([dates, instruments])
+
+    os.makedirs(path, exist_ok=True)
+    # 先删除旧的元数据，避免转换中途失败时留下不一致的存储
+    meta_path = os.path.join(path, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    field_meta: Dict[str, Dict[str, Any]] = {}
+    groups: Dict[str, List[str]] = {}
+    for name in fields:
+        column = frame[name].reindex(full_index)
+        if name in group_fields:
+            codes, labels = pd.factorize(column, sort=True)
+            values = codes.astype(np.int32)
+            groups[name] = [str(label) for label in labels]
+            dtype = np.dtype('<i4')
+        else:
+            values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float32)
+            dtype = np.dtype('<f4')
+        file_name = f"{name}.bin"
+        out = np.memmap(os.path.join(path, file_name), dtype=dtype, mode='w+',
+                        shape=(len(dates), len(instruments)))
+        out[:] = values.reshape(len(dates), len(instruments))
+        out.flush()
+        del out
+        field_meta[name] = {'file': file_name, 'dtype': dtype.str}
+
+    meta = {
+        'version': STORE_VERSION,
+        'dates': [str(pd.Timestamp(d).date()) if not isinstance(d, str) else d for d in dates],
+        'instruments': [str(i) for i in instruments],
+        'fields': field_meta,
+        'groups': groups,
+    }
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+
+    print(f"✅ 行情数据已转换: {len(dates)} 个交易日 x {len(instruments)} 只股票, {len(field_meta)} 个字段")
+    return PanelStore(path)
+
+
+def build_panel_store_from_csv(path: str, csv_path: str, fields: Optional[Sequence[str]] = None,
+                               date_column: str = 'date', instrument_column: str = 'instrument',
+                               group_fields: Iterable[str] = GROUP_FIELDS) -> PanelStore:
+    """从长表 CSV 文件转换内存映射存储"""
+    usecols = None
+    if fields is not None:
+        usecols = [date_column, instrument_column] + list(fields)
+    frame = pd.read_csv(csv_path, usecols=usecols, parse_dates=[date_column])
+    return build_panel_store(path, frame, fields, date_column, instrument_column, group_fields)
@@ -1,12 +1,30 @@
 import requests
 import json
+import os
 import time
 import pandas as pd
 from os.path import expanduser
 from requests.auth import HTTPBasicAuth
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from openai import OpenAI
 
+import alpha_store
+import profiling
+from profiling import span, traced
+from request_policy import get_policy
+from result_aggregator import ResultAggregator
+
+
+def _env_flag(name: str) -> bool:
+    """读取布尔型环境变量（1/true/yes/on 为真）"""
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_float(name: str) -> Optional[float]:
+    """读取浮点型环境变量，未设置时返回 None"""
+    value = os.environ.get(name, '').strip()
+    return float(value) if value else None
+
 
 class WorldQuantFactorOptimizer:
     def __init__(self, model=None, factor=None):
@@ -17,6 +35,8 @@ class WorldQuantFactorOptimizer:
         self.client = OpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=self.openrouter_api_key,
+            # 重试由 request_policy 统一处理
+            max_retries=0,
         )
         
         # 初始化WorldQuant会话
@@ -231,7 +251,7 @@ class WorldQuantFactorOptimizer:
         sess = requests.Session()
         sess.auth = HTTPBasicAuth(self.username, self.password)
         
-        response = sess.post('https://api.worldquantbrain.com/authentication')
+        response = get_policy('authentication').call(sess.post, 'https://api.worldquantbrain.com/authentication')
         
         # 201状态码表示登录成功，200也表示成功
         if response.status_code in [200, 201]:
@@ -245,26 +265,28 @@ class WorldQuantFactorOptimizer:
         print(f"🤖 正在使用{self.llm_model}生成因子改进建议...")
         
         try:
-            completion = self.client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "https://github.com/worldquant-factor-optimizer",
-                    "X-Title": "WorldQuant Factor Optimizer",
-                },
-                extra_body={},
-                model=self.llm_model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是一个专业的量化金融因子优化专家，精通WorldQuant Brain平台的因子语法和函数。"
+            with span('llm_request', model=self.llm_model):
+                completion = get_policy('chat').call(
+                    self.client.chat.completions.create,
+                    extra_headers={
+                        "HTTP-Referer": "https://github.com/worldquant-factor-optimizer",
+                        "X-Title": "WorldQuant Factor Optimizer",
                     },
-                    {
-                        "role": "user",
-                        "content": self.prompt_template.format(original_factor=self.original_factor)
-                    }
-                ],
-                max_tokens=2000,
-                temperature=0.7
-            )
+                    extra_body={},
+                    model=self.llm_model,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "你是一个专业的量化金融因子优化专家，精通WorldQuant Brain平台的因子语法和函数。"
+                        },
+                        {
+                            "role": "user",
+                            "content": self.prompt_template.format(original_factor=self.original_factor)
+                        }
+                    ],
+                    max_tokens=2000,
+                    temperature=0.7
+                )
             
             # 处理响应格式
             content = ""
@@ -322,22 +344,24 @@ class WorldQuantFactorOptimizer:
 改进后因子: ({self.original_factor} * rank(close - open))
 """
             
-            completion = self.client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "https://github.com/worldquant-factor-optimizer",
-                    "X-Title": "WorldQuant Factor Optimizer",
-                },
-                extra_body={},
-                model="anthropic/claude-sonnet-4",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": simple_prompt
-                    }
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
+            with span('llm_request', model="anthropic/claude-sonnet-4"):
+                completion = get_policy('chat').call(
+                    self.client.chat.completions.create,
+                    extra_headers={
+                        "HTTP-Referer": "https://github.com/worldquant-factor-optimizer",
+                        "X-Title": "WorldQuant Factor Optimizer",
+                    },
+                    extra_body={},
+                    model="anthropic/claude-sonnet-4",
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": simple_prompt
+                        }
+                    ],
+                    max_tokens=1000,
+                    temperature=0.7
+                )
             
             content = completion.choices[0].message.content
             if content:
@@ -355,6 +379,7 @@ class WorldQuantFactorOptimizer:
             print(f"❌ 简化提示词调用失败: {str(e)}")
             return self.get_default_suggestions()
 
+    @traced('parse')
     def parse_gpt_suggestions(self, content: str) -> List[Dict[str, str]]:
         """解析建议内容"""
         suggestions = []
@@ -494,6 +519,7 @@ class WorldQuantFactorOptimizer:
             }
         ]
 
+    @traced('test_factor')
     def test_factor(self, factor_expression: str, description: str) -> Dict[str, Any]:
         """测试单个因子"""
         print(f"\n🧪 正在测试因子: {description}")
@@ -521,10 +547,13 @@ class WorldQuantFactorOptimizer:
         
         try:
             # 发送模拟请求
-            sim_resp = self.sess.post(
-                'https://api.worldquantbrain.com/simulations',
-                json=simulation_data,
-            )
+            with span('submit'):
+                sim_resp = get_policy('simulations').call(
+                    self.sess.post,
+                    'https://api.worldquantbrain.com/simulations',
+                    json=simulation_data,
+                    idempotent=False,
+                )
             
             if sim_resp.status_code != 201:
                 return {
@@ -540,11 +569,13 @@ class WorldQuantFactorOptimizer:
             # 等待模拟完成
             print("⏳ 等待模拟完成...")
             while True:
-                sim_progress_resp = self.sess.get(sim_progress_url)
+                with span('poll'):
+                    sim_progress_resp = get_policy('simulations').call(self.sess.get, sim_progress_url)
                 retry_after_sec = float(sim_progress_resp.headers.get("Retry-After", 0))
                 if retry_after_sec == 0:  # 模拟完成
                     break
-                time.sleep(retry_after_sec)
+                with span('sleep', seconds=retry_after_sec):
+                    time.sleep(retry_after_sec)
             
             # 获取alpha ID
             alpha_id = sim_progress_resp.json()["alpha"]
@@ -552,7 +583,8 @@ class WorldQuantFactorOptimizer:
             
             # 获取详细结果
             alpha_details_url = f"https://api.worldquantbrain.com/alphas/{alpha_id}"
-            alpha_details_resp = self.sess.get(alpha_details_url)
+            with span('fetch'):
+                alpha_details_resp = get_policy('alphas').call(self.sess.get, alpha_details_url)
             
             if alpha_details_resp.status_code == 200:
                 alpha_data = alpha_details_resp.json()
@@ -593,8 +625,34 @@ class WorldQuantFactorOptimizer:
                 'expression': factor_expression
             }
 
-    def run_optimization(self):
-        """运行完整的因子优化流程"""
+    def fetch_alpha_history(self, alpha_ids: List[str],
+                            store_path: str = './log/alpha_store') -> alpha_store.AlphaStore:
+        """批量获取alpha详情与每日PnL序列，保存到本地时间序列存储"""
+        return alpha_store.fetch_alpha_history(self.sess, alpha_ids, store_path)
+
+    def run_optimization(self, fetch_pnl: Optional[bool] = None, profile: Optional[bool] = None,
+                         target_sharpe: Optional[float] = None):
+        """运行完整的因子优化流程
+
+        未显式传入的参数从环境变量读取，便于 main() / main.py 等入口直接开启：
+
+        Args:
+            fetch_pnl: 测试完成后是否批量获取成功因子的详情与每日PnL序列（WORLDQUANT_FETCH_PNL）
+            profile: 是否开启性能剖析，结束后在 ./log 下输出 Chrome trace 与 cProfile 报告（WORLDQUANT_PROFILE）
+            target_sharpe: 目标夏普比率，任一因子达到后提前停止测试（WORLDQUANT_TARGET_SHARPE）
+        """
+        if fetch_pnl is None:
+            fetch_pnl = _env_flag('WORLDQUANT_FETCH_PNL')
+        if profile is None:
+            profile = _env_flag('WORLDQUANT_PROFILE')
+        if target_sharpe is None:
+            target_sharpe = _env_float('WORLDQUANT_TARGET_SHARPE')
+        if profile:
+            with profiling.profile_run('./log'):
+                return self._run_optimization(fetch_pnl, target_sharpe)
+        return self._run_optimization(fetch_pnl, target_sharpe)
+
+    def _run_optimization(self, fetch_pnl: bool, target_sharpe: Optional[float]):
         print("🚀 开始WorldQuant因子优化流程")
         print("=" * 80)
         print(f"🎯 目标因子: {self.original_factor}")
@@ -608,51 +666,71 @@ class WorldQuantFactorOptimizer:
             print(f"  {i}. {suggestion['description']}")
             print(f"     表达式: {suggestion['expression']}")
         print("-" * 80)
-        
-        # 2. 测试原始因子
-        print("🔍 首先测试原始因子作为基准...")
-        original_result = self.test_factor(self.original_factor, "原始因子")
-        
-        # 3. 测试改进后的因子
-        print("\n🔄 开始测试改进后的因子...")
-        improved_results = []
-        
-        for i, suggestion in enumerate(suggestions, 1):
-            print(f"\n{'='*60}")
-            print(f"测试第 {i} 条建议")
-            print(f"{'='*60}")
-            
-            result = self.test_factor(suggestion['expression'], suggestion['description'])
-            improved_results.append(result)
-            
-            # 每测试3个因子后重新登录，避免断线
-            if i % 3 == 0:
-                print("🔄 重新登录以保持连接...")
-                self.sess = self.sign_in()
-        
+
+        # 结果逐条写入 ./log/result_<时间戳>.jsonl，状态文件可随时查看实时排行榜
+        timestamp = int(time.time())
+        with ResultAggregator(
+            stream_path=f"./log/result_{timestamp}.jsonl",
+            status_path=f"./log/status_{timestamp}.json",
+            target_sharpe=target_sharpe,
+            timestamp=timestamp,
+        ) as aggregator:
+            print(f"📡 实时状态文件: {aggregator.status_path}")
+            # 只有需要获取PnL序列时才记录alpha_id，否则内存占用与测试数量无关
+            alpha_ids: List[str] = []
+
+            # 2. 测试原始因子
+            print("🔍 首先测试原始因子作为基准...")
+            original_result = self.test_factor(self.original_factor, "原始因子")
+            aggregator.add(original_result)
+            if fetch_pnl and original_result.get('status') == 'success':
+                alpha_ids.append(original_result['alpha_id'])
+
+            # 3. 测试改进后的因子
+            print("\n🔄 开始测试改进后的因子...")
+
+            for i, suggestion in enumerate(suggestions, 1):
+                if aggregator.target_reached:
+                    print(f"⏹️ 已达到目标夏普比率，跳过剩余 {len(suggestions) - i + 1} 条建议")
+                    break
+
+                print(f"\n{'='*60}")
+                print(f"测试第 {i} 条建议")
+                print(f"{'='*60}")
+
+                result = self.test_factor(suggestion['expression'], suggestion['description'])
+                aggregator.add(result)
+                if fetch_pnl and result.get('status') == 'success':
+                    alpha_ids.append(result['alpha_id'])
+
+                # 每测试3个因子后重新登录，避免断线
+                if i % 3 == 0:
+                    print("🔄 重新登录以保持连接...")
+                    self.sess = self.sign_in()
+
         # 4. 汇总结果
-        self.summarize_results(original_result, improved_results)
+        self.summarize_results(original_result, aggregator)
+
+        # 5. 获取PnL序列，供相关性检查和后续分析
+        if fetch_pnl and alpha_ids:
+            self.fetch_alpha_history(alpha_ids)
+
+    @traced('summarize')
+    def summarize_results(self, original_result: Dict, aggregator: ResultAggregator):
+        """汇总并分析所有测试结果（基于增量汇总的排行榜与统计）"""
+        aggregator.close()
 
-    def summarize_results(self, original_result: Dict, improved_results: List[Dict]):
-        """汇总并分析所有测试结果"""
         print("\n" + "="*80)
         print("🎯 因子优化测试结果汇总")
         print("="*80)
         
-        # 收集所有成功的结果
-        all_results = [original_result] + improved_results
-        successful_results = [r for r in all_results if r.get('status') == 'success']
-        failed_results = [r for r in all_results if r.get('status') != 'success']
-        
-        print(f"✅ 成功测试: {len(successful_results)} 个因子")
-        print(f"❌ 测试失败: {len(failed_results)} 个因子")
+        print(f"✅ 成功测试: {aggregator.succeeded} 个因子")
+        print(f"❌ 测试失败: {aggregator.failed} 个因子")
         
-        if successful_results:
-            # 按夏普比率排序
-            successful_results.sort(key=lambda x: x.get('sharpe', 0), reverse=True)
-            
-            print(f"\n🏆 因子排名 (按夏普比率):")
-            for i, result in enumerate(successful_results, 1):
+        leaderboard = aggregator.leaderboard()
+        if leaderboard:
+            print(f"\n🏆 因子排名 (按夏普比率, 前 {len(leaderboard)} 名):")
+            for i, result in enumerate(leaderboard, 1):
                 status_icon = "🆕" if result.get('description') != "原始因子" else "📊"
                 print(f"  {i}. {status_icon} {result.get('description', '未知')}")
                 print(f"     夏普比率: {result.get('sharpe', 0):.3f}")
@@ -662,9 +740,9 @@ class WorldQuantFactorOptimizer:
                 print()
             
             # 找出最佳改进
-            if len(successful_results) > 1:
+            if len(leaderboard) > 1:
                 best_improved = None
-                for result in successful_results:
+                for result in leaderboard:
                     if result.get('description') != "原始因子":
                         best_improved = result
                         break
@@ -675,18 +753,20 @@ class WorldQuantFactorOptimizer:
                     print(f"   夏普比率提升: {improvement:.3f}")
                     print(f"   改进后表达式: {best_improved.get('expression')}")
         
-        # 保存结果
-        timestamp = int(time.time())
+        # 保存汇总（完整结果已逐条写入 results_file），与结果流、状态文件使用同一时间戳
+        timestamp = aggregator.timestamp
         results_file = f"./log/result_{timestamp}.json"
         
         with open(results_file, 'w', encoding='utf-8') as f:
             json.dump({
                 'original_factor': self.original_factor,
                 'timestamp': timestamp,
-                'results': all_results
+                'original_result': original_result,
+                **aggregator.snapshot(),
             }, f, indent=2, ensure_ascii=False, default=str)
         
-        print(f"\n📁 详细结果已保存到: {results_file}")
+        print(f"\n📁 汇总结果已保存到: {results_file}")
+        print(f"📁 全部测试结果已保存到: {aggregator.stream_path}")
         print("🎉 因子优化测试完成！")
 
 
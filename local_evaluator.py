@@ -0,0 +1,894 @@
+"""
+本地因子评估器
+
+在本地行情面板 (日期 x 股票) 上对候选因子表达式做快速初筛，
+只返回紧凑的指标 (夏普比率、换手率、适应度)，用于在提交到
+WorldQuant Brain 之前过滤掉明显无效的候选因子。
+
+大批量候选因子通过进程池并行评估：行情面板只加载一次并放入
+共享内存，工作进程以零拷贝方式挂载，候选因子按批分发以摊薄进程间通信开销。
+若面板来自 data_store.PanelStore，工作进程直接按路径映射同一组文件，
+由操作系统页缓存共享，无需再复制到共享内存。
+"""
+
+import math
+import os
+import re
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+import numpy as np
+
+from data_store import PanelStore
+
+# 年化因子（每年交易日数）
+TRADING_DAYS = 252
+
+
+class ExpressionError(ValueError):
+    """因子表达式解析或求值失败"""
+
+
+# ---------------------------------------------------------------------------
+# 表达式解析
+# ---------------------------------------------------------------------------
+
+_TOKEN_PATTERN = re.compile(
+    r"\s*(?:(\d+\.\d*|\.\d+|\d+)|([A-Za-z_][A-Za-z0-9_]*)|(<=|>=|==|!=|&&|\|\||[-+*/^(),<>=?:]))"
+)
+
+# 二元运算符优先级（数值越大优先级越高）
+_BINARY_PRECEDENCE = {
+    "||": 1,
+    "&&": 2,
+    "<": 3, "<=": 3, ">": 3, ">=": 3, "==": 3, "!=": 3,
+    "+": 4, "-": 4,
+    "*": 5, "/": 5,
+    "^": 6,
+}
+
+
+def _tokenize(expression: str) -> List[Tuple[str, str]]:
+    """将表达式切分为 (类型, 值) 记号列表"""
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        m = _TOKEN_PATTERN.match(expression, pos)
+        if not m or m.end() == pos:
+            raise ExpressionError(f"无法识别的字符: {expression[pos:pos + 10]!r}")
+        number, name, op = m.groups()
+        if number is not None:
+            tokens.append(("num", number))
+        elif name is not None:
+            tokens.append(("name", name))
+        else:
+            tokens.append(("op", op))
+        pos = m.end()
+        # 跳过末尾空白
+        while pos < len(expression) and expression[pos].isspace():
+            pos += 1
+    return tokens
+
+
+class _Parser:
+    """递归下降解析器，生成嵌套元组形式的语法树
+
+    节点形式:
+        ("num", float)
+        ("field", name)
+        ("neg", node)
+        ("bin", op, left, right)
+        ("call", name, [args], {kwargs})
+    """
+
+    def __init__(self, expression: str):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self, value: Optional[str] = None) -> Tuple[str, str]:
+        token = self.peek()
+        if token is None:
+            raise ExpressionError("表达式意外结束")
+        if value is not None and token[1] != value:
+            raise ExpressionError(f"期望 {value!r}，实际为 {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def parse(self) -> tuple:
+        node = self.parse_binary(0)
+        if self.peek() is not None:
+            raise ExpressionError(f"多余的记号: {self.peek()[1]!r}")
+        return node
+
+    def parse_binary(self, min_precedence: int) -> tuple:
+        left = self.parse_unary()
+        while True:
+            token = self.peek()
+            if token is None or token[0] != "op":
+                break
+            if token[1] == "?":
+                # 三元表达式 a ? b : c 等价于 if_else(a, b, c)
+                if min_precedence > 0:
+                    break
+                self.take("?")
+                true_branch = self.parse_binary(0)
+                self.take(":")
+                false_branch = self.parse_binary(0)
+                left = ("call", "if_else", [left, true_branch, false_branch], {})
+                continue
+            precedence = _BINARY_PRECEDENCE.get(token[1])
+            if precedence is None or precedence < min_precedence:
+                break
+            self.take()
+            # ^ 为右结合，其余左结合
+            next_min = precedence if token[1] == "^" else precedence + 1
+            right = self.parse_binary(next_min)
+            left = ("bin", token[1], left, right)
+        return left
+
+    def parse_unary(self) -> tuple:
+        token = self.peek()
+        if token == ("op", "-"):
+            self.take()
+            return ("neg", self.parse_unary())
+        if token == ("op", "+"):
+            self.take()
+            return self.parse_unary()
+        return self.parse_primary()
+
+    def parse_primary(self) -> tuple:
+        kind, value = self.take()
+        if kind == "num":
+            return ("num", float(value))
+        if kind == "name":
+            if self.peek() == ("op", "("):
+                return self.parse_call(value)
+            if value.lower() in ("true", "false"):
+                return ("num", 1.0 if value.lower() == "true" else 0.0)
+            return ("field", value)
+        if value == "(":
+            node = self.parse_binary(0)
+            self.take(")")
+            return node
+        raise ExpressionError(f"意外的记号: {value!r}")
+
+    def parse_call(self, name: str) -> tuple:
+        self.take("(")
+        args: List[tuple] = []
+        kwargs: Dict[str, tuple] = {}
+        if self.peek() != ("op", ")"):
+            while True:
+                token = self.peek()
+                nxt = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else None
+                if token is not None and token[0] == "name" and nxt == ("op", "="):
+                    self.pos += 2
+                    kwargs[token[1]] = self.parse_kwarg_value()
+                else:
+                    args.append(self.parse_binary(0))
+                if self.peek() == ("op", ","):
+                    self.take()
+                    continue
+                break
+        self.take(")")
+        return ("call", name, args, kwargs)
+
+    def parse_kwarg_value(self) -> tuple:
+        # 关键字参数的取值可以是数字、布尔值或裸标识符（如 driver=gaussian）
+        token = self.peek()
+        if token is not None and token[0] == "name":
+            nxt = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else None
+            if nxt != ("op", "("):
+                self.take()
+                lowered = token[1].lower()
+                if lowered in ("true", "false"):
+                    return ("num", 1.0 if lowered == "true" else 0.0)
+                return ("str", token[1])
+        return self.parse_binary(0)
+
+
+def parse_expression(expression: str) -> tuple:
+    """解析因子表达式为语法树"""
+    return _Parser(expression).parse()
+
+
+def expression_fields(expression: str) -> Set[str]:
+    """返回表达式中引用的所有数据字段名"""
+    fields: Set[str] = set()
+
+    def walk(node: tuple) -> None:
+        kind = node[0]
+        if kind == "field":
+            fields.add(node[1])
+        elif kind == "neg":
+            walk(node[1])
+        elif kind == "bin":
+            walk(node[2])
+            walk(node[3])
+        elif kind == "call":
+            for arg in node[2]:
+                walk(arg)
+            for arg in node[3].values():
+                walk(arg)
+
+    walk(parse_expression(expression))
+    return fields
+
+
+# ---------------------------------------------------------------------------
+# 算子实现（输入均为 (日期, 股票) 的二维数组）
+# ---------------------------------------------------------------------------
+
+def _as_float(x: Any) -> np.ndarray:
+    return np.asarray(x, dtype=np.float64)
+
+
+def _window(d: Any) -> int:
+    d = int(round(float(d)))
+    if d < 1:
+        raise ExpressionError(f"窗口长度必须为正整数: {d}")
+    return d
+
+
+def _shift(x: np.ndarray, k: int) -> np.ndarray:
+    """沿时间轴向后平移 k 天，前 k 行填充 NaN"""
+    out = np.full(x.shape, np.nan)
+    if k < x.shape[0]:
+        out[k:] = x[:x.shape[0] - k]
+    return out
+
+
+def _rolling_sum(x: np.ndarray, d: int) -> Tuple[np.ndarray, np.ndarray]:
+    """滚动求和（忽略 NaN），返回 (和, 有效样本数)"""
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=0, dtype=np.float64)
+    ccount = np.cumsum(valid, axis=0, dtype=np.float64)
+    total = csum.copy()
+    count = ccount.copy()
+    total[d:] -= csum[:-d]
+    count[d:] -= ccount[:-d]
+    total[:d - 1] = np.nan
+    return total, count
+
+
+def ts_sum(x: Any, d: Any) -> np.ndarray:
+    total, count = _rolling_sum(_as_float(x), _window(d))
+    return np.where(count > 0, total, np.nan)
+
+
+def ts_mean(x: Any, d: Any) -> np.ndarray:
+    total, count = _rolling_sum(_as_float(x), _window(d))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def ts_std_dev(x: Any, d: Any) -> np.ndarray:
+    x = _as_float(x)
+    d = _window(d)
+    total, count = _rolling_sum(x, d)
+    total_sq, _ = _rolling_sum(x * x, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        var = np.maximum(total_sq / count - mean * mean, 0.0)
+        return np.where(count > 1, np.sqrt(var), np.nan)
+
+
+def ts_zscore(x: Any, d: Any) -> np.ndarray:
+    x = _as_float(x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (x - ts_mean(x, d)) / ts_std_dev(x, d)
+
+
+def ts_covariance(x: Any, y: Any, d: Any) -> np.ndarray:
+    x, y = np.broadcast_arrays(_as_float(x), _as_float(y))
+    d = _window(d)
+    mask = np.isnan(x) | np.isnan(y)
+    x = np.where(mask, np.nan, x)
+    y = np.where(mask, np.nan, y)
+    sx, count = _rolling_sum(x, d)
+    sy, _ = _rolling_sum(y, d)
+    sxy, _ = _rolling_sum(x * y, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sxy / count - (sx / count) * (sy / count)
+        return np.where(count > 1, cov, np.nan)
+
+
+def ts_corr(x: Any, y: Any, d: Any) -> np.ndarray:
+    x, y = np.broadcast_arrays(_as_float(x), _as_float(y))
+    d = _window(d)
+    mask = np.isnan(x) | np.isnan(y)
+    x = np.where(mask, np.nan, x)
+    y = np.where(mask, np.nan, y)
+    cov = ts_covariance(x, y, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = cov / (ts_std_dev(x, d) * ts_std_dev(y, d))
+    corr[~np.isfinite(corr)] = np.nan
+    return corr
+
+
+def ts_delay(x: Any, d: Any) -> np.ndarray:
+    d = int(round(float(d)))
+    if d < 0:
+        raise ExpressionError(f"延迟天数不能为负数: {d}")
+    return _shift(_as_float(x), d)
+
+
+def ts_delta(x: Any, d: Any) -> np.ndarray:
+    x = _as_float(x)
+    return x - _shift(x, _window(d))
+
+
+def ts_decay_linear(x: Any, d: Any, dense: Any = 0.0) -> np.ndarray:
+    x = _as_float(x)
+    d = _window(d)
+    total = np.zeros(x.shape)
+    weight = np.zeros(x.shape)
+    for k in range(d):
+        lagged = _shift(x, k)
+        valid = ~np.isnan(lagged)
+        w = float(d - k)
+        total += np.where(valid, lagged, 0.0) * w
+        weight += valid * w
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(weight > 0, total / weight, np.nan)
+    out[:d - 1] = np.nan
+    return out
+
+
+def ts_rank(x: Any, d: Any, constant: Any = 0.0) -> np.ndarray:
+    x = _as_float(x)
+    d = _window(d)
+    below = np.zeros(x.shape)
+    count = np.zeros(x.shape)
+    for k in range(d):
+        lagged = _shift(x, k)
+        valid = ~np.isnan(lagged)
+        below += valid & (lagged < x)
+        count += valid
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(count > 1, below / (count - 1), np.nan)
+    out[np.isnan(x)] = np.nan
+    out[:d - 1] = np.nan
+    return out + float(constant)
+
+
+def ts_product(x: Any, d: Any) -> np.ndarray:
+    x = _as_float(x)
+    d = _window(d)
+    out = np.ones(x.shape)
+    for k in range(d):
+        out *= _shift(x, k)
+    return out
+
+
+def ts_scale(x: Any, d: Any, constant: Any = 0.0) -> np.ndarray:
+    x = _as_float(x)
+    d = _window(d)
+    lo = np.full(x.shape, np.inf)
+    hi = np.full(x.shape, -np.inf)
+    for k in range(d):
+        lagged = _shift(x, k)
+        lo = np.fmin(lo, lagged)
+        hi = np.fmax(hi, lagged)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (x - lo) / (hi - lo)
+    out[~np.isfinite(out)] = np.nan
+    out[:d - 1] = np.nan
+    return out + float(constant)
+
+
+def rank(x: Any, rate: Any = 2.0) -> np.ndarray:
+    """截面排名，结果落在 [0, 1]（NaN 保持不变）"""
+    x = _as_float(x)
+    if x.ndim == 1:
+        return rank(x[None, :])[0]
+    nan = np.isnan(x)
+    # argsort 会把 NaN 排在最后，因此前 n 个位置即为有效值的排名
+    order = np.argsort(x, axis=1, kind="stable")
+    ranks = np.empty(x.shape)
+    positions = np.broadcast_to(np.arange(x.shape[1], dtype=np.float64), x.shape)
+    np.put_along_axis(ranks, order, positions, axis=1)
+    n = (~nan).sum(axis=1, keepdims=True).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(n > 1, ranks / (n - 1), 0.5)
+    out[nan] = np.nan
+    return out
+
+
+def zscore(x: Any) -> np.ndarray:
+    x = _as_float(x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nanmean(x, axis=-1, keepdims=True)
+        std = np.nanstd(x, axis=-1, keepdims=True)
+        return (x - mean) / std
+
+
+def normalize(x: Any, useStd: Any = 0.0, limit: Any = 0.0) -> np.ndarray:
+    x = _as_float(x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = x - np.nanmean(x, axis=-1, keepdims=True)
+        if float(useStd):
+            out = out / np.nanstd(x, axis=-1, keepdims=True)
+    if float(limit):
+        out = np.clip(out, -float(limit), float(limit))
+    return out
+
+
+def scale(x: Any, scale: Any = 1.0, longscale: Any = 1.0, shortscale: Any = 1.0) -> np.ndarray:
+    x = _as_float(x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return x * float(scale) / np.nansum(np.abs(x), axis=-1, keepdims=True)
+
+
+def winsorize(x: Any, std: Any = 4.0) -> np.ndarray:
+    x = _as_float(x)
+    with np.errstate(invalid="ignore"):
+        mean = np.nanmean(x, axis=-1, keepdims=True)
+        sd = np.nanstd(x, axis=-1, keepdims=True)
+    limit = float(std) * sd
+    return np.clip(x, mean - limit, mean + limit)
+
+
+def quantile(x: Any, driver: Any = "gaussian", sigma: Any = 1.0) -> np.ndarray:
+    # 以排名近似分位数变换，足以满足本地初筛
+    return rank(x) - 0.5
+
+
+def _group_codes(group: Any, shape: Tuple[int, ...]) -> Tuple[np.ndarray, int]:
+    codes = np.broadcast_to(np.asarray(group), shape)
+    codes = np.where(np.isnan(codes.astype(np.float64)), -1, codes).astype(np.int64)
+    n_groups = int(codes.max()) + 1 if codes.size else 0
+    return codes, max(n_groups, 1)
+
+
+def _group_reduce(x: np.ndarray, weight: np.ndarray, group: Any) -> np.ndarray:
+    """按 (日期, 分组) 计算加权均值，并映射回原形状"""
+    codes, n_groups = _group_codes(group, x.shape)
+    rows = np.arange(x.shape[0])[:, None] * n_groups
+    flat = (rows + codes).ravel()
+    valid = (~np.isnan(x) & ~np.isnan(weight) & (codes >= 0)).ravel()
+    size = x.shape[0] * n_groups
+    sums = np.bincount(flat[valid], (x * weight).ravel()[valid], minlength=size)
+    weights = np.bincount(flat[valid], weight.ravel()[valid], minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / weights
+    out = means[np.clip(flat, 0, size - 1)].reshape(x.shape)
+    out[codes < 0] = np.nan
+    return out
+
+
+def group_mean(x: Any, weight: Any, group: Any) -> np.ndarray:
+    x = _as_float(x)
+    weight = np.broadcast_to(_as_float(weight), x.shape)
+    return _group_reduce(x, weight, group)
+
+
+def group_neutralize(x: Any, group: Any) -> np.ndarray:
+    x = _as_float(x)
+    return x - _group_reduce(x, np.ones(x.shape), group)
+
+
+def group_zscore(x: Any, group: Any) -> np.ndarray:
+    x = _as_float(x)
+    ones = np.ones(x.shape)
+    mean = _group_reduce(x, ones, group)
+    var = _group_reduce((x - mean) ** 2, ones, group)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (x - mean) / np.sqrt(var)
+
+
+def group_rank(x: Any, group: Any) -> np.ndarray:
+    x = _as_float(x)
+    codes, n_groups = _group_codes(group, x.shape)
+    valid = ~np.isnan(x) & (codes >= 0)
+    codes = np.where(valid, codes, 0)
+    # 截面排名落在 [0, 1]，以 2 为间隔叠加分组编码后一次排序即可得到组内顺序
+    key = np.where(valid, codes * 2.0 + rank(x), np.nan)
+    order = np.argsort(key, axis=1, kind="stable")
+    positions = np.empty(x.shape)
+    np.put_along_axis(positions, order, np.broadcast_to(np.arange(x.shape[1], dtype=np.float64), x.shape),
+                      axis=1)
+    rows = np.arange(x.shape[0])[:, None] * n_groups
+    counts = np.bincount((rows + codes)[valid], minlength=x.shape[0] * n_groups)
+    counts = counts.reshape(x.shape[0], n_groups)
+    starts = np.cumsum(counts, axis=1) - counts
+    start = np.take_along_axis(starts, codes, axis=1)
+    size = np.take_along_axis(counts, codes, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(size > 1, (positions - start) / (size - 1), 0.5)
+    out[~valid] = np.nan
+    return out
+
+
+def if_else(condition: Any, x: Any, y: Any) -> np.ndarray:
+    condition = _as_float(condition)
+    out = np.where(condition > 0, _as_float(x), _as_float(y))
+    return np.where(np.isnan(condition), np.nan, out)
+
+
+def _binary_max(*args: Any) -> np.ndarray:
+    out = _as_float(args[0])
+    for arg in args[1:]:
+        out = np.maximum(out, _as_float(arg))
+    return out
+
+
+def _binary_min(*args: Any) -> np.ndarray:
+    out = _as_float(args[0])
+    for arg in args[1:]:
+        out = np.minimum(out, _as_float(arg))
+    return out
+
+
+def _add(*args: Any, filter: Any = 0.0) -> np.ndarray:
+    out = _as_float(args[0])
+    for arg in args[1:]:
+        out = out + _as_float(arg)
+    return out
+
+
+def _multiply(*args: Any, filter: Any = 0.0) -> np.ndarray:
+    out = _as_float(args[0])
+    for arg in args[1:]:
+        out = out * _as_float(arg)
+    return out
+
+
+def _safe(func: Callable[..., np.ndarray]) -> Callable[..., np.ndarray]:
+    def wrapper(*args: Any, **kwargs: Any) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# 支持的算子表（名称与 operators.txt 中的 WorldQuant Brain 函数保持一致）
+OPERATORS: Dict[str, Callable[..., np.ndarray]] = {
+    "abs": np.abs,
+    "add": _add,
+    "subtract": _safe(lambda x, y, filter=0.0: _as_float(x) - _as_float(y)),
+    "multiply": _multiply,
+    "divide": _safe(lambda x, y: _as_float(x) / _as_float(y)),
+    "power": _safe(lambda x, y: np.power(_as_float(x), _as_float(y))),
+    "signed_power": _safe(lambda x, y: np.sign(_as_float(x)) * np.power(np.abs(_as_float(x)), _as_float(y))),
+    "sqrt": _safe(lambda x: np.sqrt(_as_float(x))),
+    "log": _safe(lambda x: np.log(_as_float(x))),
+    "sign": np.sign,
+    "inverse": _safe(lambda x: 1.0 / _as_float(x)),
+    "reverse": lambda x: -_as_float(x),
+    "max": _binary_max,
+    "min": _binary_min,
+    "is_nan": lambda x: np.isnan(_as_float(x)).astype(np.float64),
+    "if_else": if_else,
+    "and": lambda x, y: ((_as_float(x) > 0) & (_as_float(y) > 0)).astype(np.float64),
+    "or": lambda x, y: ((_as_float(x) > 0) | (_as_float(y) > 0)).astype(np.float64),
+    "not": lambda x: (_as_float(x) <= 0).astype(np.float64),
+    "ts_sum": ts_sum,
+    "ts_mean": ts_mean,
+    "ts_std_dev": ts_std_dev,
+    "ts_stddev": ts_std_dev,
+    "ts_zscore": _safe(ts_zscore),
+    "ts_covariance": ts_covariance,
+    "ts_corr": ts_corr,
+    "ts_delay": ts_delay,
+    "ts_delta": ts_delta,
+    "ts_decay_linear": ts_decay_linear,
+    "ts_rank": ts_rank,
+    "ts_product": ts_product,
+    "ts_scale": ts_scale,
+    "rank": rank,
+    "zscore": zscore,
+    "normalize": normalize,
+    "scale": _safe(scale),
+    "winsorize": winsorize,
+    "quantile": quantile,
+    "group_mean": group_mean,
+    "group_neutralize": group_neutralize,
+    "group_zscore": _safe(group_zscore),
+    "group_rank": group_rank,
+}
+
+_BINARY_FUNCS: Dict[str, Callable[[np.ndarray, np.ndarray], np.ndarray]] = {
+    "+": np.add,
+    "-": np.subtract,
+    "*": np.multiply,
+    "/": np.divide,
+    "^": np.power,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+    "&&": lambda x, y: (x > 0) & (y > 0),
+    "||": lambda x, y: (x > 0) | (y > 0),
+}
+
+
+def evaluate_expression(expression: str, panels: Mapping[str, np.ndarray]) -> np.ndarray:
+    """在行情面板上计算因子值，返回 (日期, 股票) 的二维数组"""
+    tree = parse_expression(expression)
+
+    def ev(node: tuple) -> Any:
+        kind = node[0]
+        if kind == "num":
+            return node[1]
+        if kind == "str":
+            return node[1]
+        if kind == "field":
+            name = node[1]
+            if name == "market" and name not in panels:
+                return 0
+            try:
+                return panels[name]
+            except KeyError:
+                raise ExpressionError(f"未知字段: {name}") from None
+        if kind == "neg":
+            return -_as_float(ev(node[1]))
+        if kind == "bin":
+            left, right = _as_float(ev(node[2])), _as_float(ev(node[3]))
+            with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+                out = _BINARY_FUNCS[node[1]](left, right)
+            if node[1] in ("<", "<=", ">", ">=", "==", "!=", "&&", "||"):
+                out = np.where(np.isnan(left) | np.isnan(right), np.nan, out.astype(np.float64))
+            return out
+        # 函数调用
+        name = node[1]
+        func = OPERATORS.get(name)
+        if func is None:
+            raise ExpressionError(f"不支持的函数: {name}")
+        args = [ev(arg) for arg in node[2]]
+        kwargs = {key: ev(value) for key, value in node[3].items()}
+        try:
+            return func(*args, **kwargs)
+        except TypeError as e:
+            raise ExpressionError(f"{name} 参数错误: {e}") from None
+
+    # 全 NaN 的截面（如窗口预热期）会触发 numpy 的空切片告警，这里统一忽略
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        result = _as_float(ev(tree))
+    if result.ndim != 2:
+        raise ExpressionError("因子表达式结果必须是 (日期, 股票) 的二维数组")
+    return result
+
+
+# ---------------------------------------------------------------------------
+# 简易回测指标
+# ---------------------------------------------------------------------------
+
+def daily_returns(panels: Mapping[str, np.ndarray]) -> np.ndarray:
+    """获取日收益率面板，缺失 returns 字段时由收盘价推算
+
+    已有 returns 字段时直接返回原数组，不做类型转换，避免复制整个面板。
+    """
+    if "returns" in panels:
+        return np.asarray(panels["returns"])
+    close = _as_float(panels["close"])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return close / _shift(close, 1) - 1.0
+
+
+def compute_metrics(alpha: np.ndarray, returns: np.ndarray) -> Dict[str, float]:
+    """按市场中性、总多空仓位为 1 的方式持仓，计算夏普比率、换手率和适应度
+
+    t 日收盘计算的权重在 t+1 日获得收益 (delay 1)。
+    """
+    alpha = np.array(alpha, dtype=np.float64)
+    alpha[~np.isfinite(alpha)] = np.nan
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        demeaned = alpha - np.nanmean(alpha, axis=1, keepdims=True)
+        weights = demeaned / np.nansum(np.abs(demeaned), axis=1, keepdims=True)
+    weights = np.nan_to_num(weights, nan=0.0, posinf=0.0, neginf=0.0)
+
+    pnl = np.nansum(weights[:-1] * returns[1:], axis=1)
+    turnover_daily = np.abs(np.diff(weights, axis=0)).sum(axis=1)
+
+    # 去掉因窗口预热而没有持仓的起始阶段
+    active = np.flatnonzero(np.abs(weights).sum(axis=1) > 0)
+    if active.size == 0 or pnl.size < 2:
+        return {"sharpe": 0.0, "turnover": 0.0, "fitness": 0.0, "returns": 0.0}
+    start = int(active[0])
+    pnl = pnl[start:]
+    turnover_daily = turnover_daily[start:]
+
+    std = float(pnl.std())
+    sharpe = float(pnl.mean()) / std * math.sqrt(TRADING_DAYS) if std > 0 else 0.0
+    annual_returns = float(pnl.mean()) * TRADING_DAYS
+    turnover = float(turnover_daily.mean()) if turnover_daily.size else 0.0
+    fitness = sharpe * math.sqrt(abs(annual_returns) / max(turnover, 0.125))
+    return {
+        "sharpe": sharpe,
+        "turnover": turnover,
+        "fitness": fitness,
+        "returns": annual_returns,
+    }
+
+
+def evaluate_factor(expression: str, panels: Mapping[str, np.ndarray],
+                    returns: Optional[np.ndarray] = None) -> Dict[str, float]:
+    """计算单个因子的本地指标"""
+    if returns is None:
+        returns = daily_returns(panels)
+    return compute_metrics(evaluate_expression(expression, panels), returns)
+
+
+# ---------------------------------------------------------------------------
+# 共享内存面板与进程池
+# ---------------------------------------------------------------------------
+
+class SharedPanels:
+    """将行情面板放入共享内存，供工作进程零拷贝挂载
+
+    spec 为可序列化的描述 {字段: (共享内存名, 形状, dtype)}，
+    工作进程调用 attach(spec) 即可得到直接指向共享内存的 numpy 视图。
+    """
+
+    def __init__(self, panels: Mapping[str, np.ndarray]):
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self.spec: Dict[str, Tuple[str, Tuple[int, ...], str]] = {}
+        try:
+            for name, array in panels.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+                view[...] = array
+                self.spec[name] = (block.name, array.shape, array.dtype.str)
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def attach(spec: Mapping[str, Tuple[str, Tuple[int, ...], str]]
+               ) -> Tuple[Dict[str, np.ndarray], List[shared_memory.SharedMemory]]:
+        """挂载共享内存，返回 (字段视图, 共享内存句柄)；句柄需在视图使用期间保持存活"""
+        arrays: Dict[str, np.ndarray] = {}
+        blocks: List[shared_memory.SharedMemory] = []
+        for name, (block_name, shape, dtype) in spec.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            view.flags.writeable = False
+            arrays[name] = view
+        return arrays, blocks
+
+    def close(self) -> None:
+        """释放并删除共享内存"""
+        for block in self._blocks:
+            try:
+                block.close()
+                block.unlink()
+            except FileNotFoundError:
+                pass
+        self._blocks = []
+        self.spec = {}
+
+
+# 工作进程内的全局状态（由 _init_worker 在进程启动时设置一次）
+_WORKER_PANELS: Optional[Mapping[str, np.ndarray]] = None
+_WORKER_RETURNS: Optional[np.ndarray] = None
+_WORKER_BLOCKS: List[Any] = []
+
+
+def _init_worker(spec: Mapping[str, Tuple[str, Tuple[int, ...], str]],
+                 store_path: Optional[str]) -> None:
+    global _WORKER_PANELS, _WORKER_RETURNS, _WORKER_BLOCKS
+    arrays, _WORKER_BLOCKS = SharedPanels.attach(spec)
+    _WORKER_PANELS = PanelStore(store_path) if store_path is not None else arrays
+    # returns 已由主进程准备好（共享内存块或存储中的字段），这里只挂载，不在每个进程中各自复制一份
+    _WORKER_RETURNS = arrays["returns"] if "returns" in arrays else _WORKER_PANELS["returns"]
+
+
+def _evaluate_batch(expressions: List[str]) -> List[Tuple[str, Any]]:
+    """在工作进程中评估一批因子，只返回紧凑结果以减少进程间通信"""
+    if _WORKER_PANELS is None:
+        raise RuntimeError("工作进程尚未初始化")
+    out: List[Tuple[str, Any]] = []
+    for expression in expressions:
+        try:
+            m = evaluate_factor(expression, _WORKER_PANELS, _WORKER_RETURNS)
+            out.append(("success", (m["sharpe"], m["turnover"], m["fitness"])))
+        except Exception as e:
+            out.append(("error", str(e)))
+    return out
+
+
+class LocalFactorEvaluator:
+    """基于进程池的本地因子批量评估器
+
+    用法::
+
+        with LocalFactorEvaluator({"close": close, "open": open_, ...}) as evaluator:
+            results = evaluator.evaluate(expressions)
+
+    panels 也可以是 data_store.PanelStore，此时字段按需映射，不复制到共享内存；
+    存储中没有 returns 字段时，只有主进程算出的收益率放入共享内存。
+    """
+
+    def __init__(self, panels: Mapping[str, np.ndarray], workers: Optional[int] = None,
+                 batch_size: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self._store_path: Optional[str] = None
+        self._shared: Optional[SharedPanels] = None
+        # 收益率面板在主进程计算一次，放入共享内存供所有工作进程挂载；
+        # 存储只读，不会向其中写入 returns 字段
+        if isinstance(panels, PanelStore):
+            self._store_path = panels.path
+            shared: Mapping[str, np.ndarray] = {}
+            if "returns" not in panels:
+                shared = {"returns": daily_returns(panels).astype(np.float32)}
+        else:
+            shared = panels
+            if "returns" not in panels:
+                shared = dict(panels, returns=daily_returns(panels).astype(np.float32))
+        self._shared = SharedPanels(shared)
+        self._closed = False
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # 进程池在多次 evaluate 之间复用，每个工作进程只挂载一次面板
+        if self._pool is None:
+            if self._closed or self._shared is None:
+                raise RuntimeError("评估器已关闭")
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self._shared.spec, self._store_path),
+            )
+        return self._pool
+
+    def _batches(self, expressions: List[str]) -> List[List[str]]:
+        size = self.batch_size
+        if not size:
+            # 每个进程约分到 4 批，兼顾通信开销与负载均衡
+            size = max(1, math.ceil(len(expressions) / (self.workers * 4)))
+        return [expressions[i:i + size] for i in range(0, len(expressions), size)]
+
+    def evaluate(self, expressions: List[str]) -> List[Dict[str, Any]]:
+        """并行评估一组因子表达式，结果顺序与输入一致"""
+        if not expressions:
+            return []
+        pool = self._get_pool()
+        batches = self._batches(list(expressions))
+        results: List[Dict[str, Any]] = []
+        for batch, batch_results in zip(batches, pool.map(_evaluate_batch, batches)):
+            for expression, (status, payload) in zip(batch, batch_results):
+                if status == "success":
+                    sharpe, turnover, fitness = payload
+                    results.append({
+                        'status': 'success',
+                        'expression': expression,
+                        'sharpe': sharpe,
+                        'turnover': turnover,
+                        'fitness': fitness,
+                    })
+                else:
+                    results.append({
+                        'status': 'error',
+                        'error': payload,
+                        'expression': expression,
+                    })
+        return results
+
+    def close(self) -> None:
+        """关闭进程池并释放共享内存"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+        self._closed = True
+
+    def __enter__(self) -> "LocalFactorEvaluator":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
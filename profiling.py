@@ -0,0 +1,173 @@
+"""
+优化流程的性能剖析
+
+默认关闭。开启后（run_optimization(profile=True)、环境变量 WORLDQUANT_PROFILE=1
+或 with profile_run(): ...）：
+
+- 记录每个阶段（LLM 请求、解析、提交、轮询、等待、获取、汇总）的
+  墙钟时间与 CPU 时间，输出为 Chrome trace-event JSON，
+  可在 chrome://tracing 或 https://ui.perfetto.dev 中以火焰图查看
+- 同时运行 cProfile，输出按函数聚合的报告
+
+关闭时 span() 直接返回一个共享的空上下文管理器，几乎没有额外开销。
+"""
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class _NullSpan:
+    """未开启剖析时使用的空上下文管理器"""
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer: "Tracer", name: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() - self.cpu_start
+        self.tracer.record(self.name, self.wall_start, wall, cpu, self.args)
+
+
+class Tracer:
+    """收集阶段耗时并运行 cProfile"""
+
+    def __init__(self) -> None:
+        self.events: List[Dict[str, Any]] = []
+        self.origin = time.perf_counter()
+        self.profiler = cProfile.Profile()
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **args: Any) -> _Span:
+        return _Span(self, name, args)
+
+    def record(self, name: str, start: float, wall: float, cpu: float, args: Dict[str, Any]) -> None:
+        event = {
+            'name': name,
+            'cat': name.split('.', 1)[0],
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': wall * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': dict(args, cpu_ms=round(cpu * 1000, 3)),
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """按阶段名聚合：次数、总墙钟时间、总 CPU 时间（毫秒）"""
+        stats: Dict[str, Dict[str, Any]] = {}
+        for event in self.events:
+            item = stats.setdefault(
+                event['name'], {'name': event['name'], 'count': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0}
+            )
+            item['count'] += 1
+            item['wall_ms'] += event['dur'] / 1000
+            item['cpu_ms'] += event['args']['cpu_ms']
+        return sorted(stats.values(), key=lambda x: x['wall_ms'], reverse=True)
+
+    def write(self, out_dir: str, prefix: str) -> Dict[str, str]:
+        """写出 Chrome trace JSON 和 cProfile 报告，返回文件路径"""
+        os.makedirs(out_dir, exist_ok=True)
+        trace_path = os.path.join(out_dir, f"{prefix}.trace.json")
+        report_path = os.path.join(out_dir, f"{prefix}.profile.txt")
+        stats_path = os.path.join(out_dir, f"{prefix}.prof")
+
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+        self.profiler.dump_stats(stats_path)
+        buffer = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=buffer)
+        stats.sort_stats('cumulative').print_stats(50)
+        stats.sort_stats('tottime').print_stats(30)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write("阶段汇总 (毫秒):\n")
+            for item in self.summary():
+                f.write(f"  {item['name']:<24} 次数 {item['count']:>5}  "
+                        f"墙钟 {item['wall_ms']:>12.1f}  CPU {item['cpu_ms']:>10.1f}\n")
+            f.write("\n")
+            f.write(buffer.getvalue())
+
+        return {'trace': trace_path, 'report': report_path, 'stats': stats_path}
+
+
+# 当前生效的 tracer；为 None 时剖析关闭
+_active: Optional[Tracer] = None
+
+
+def span(name: str, **args: Any) -> Any:
+    """记录一个阶段；未开启剖析时为空操作"""
+    if _active is None:
+        return _NULL_SPAN
+    return _active.span(name, **args)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """将整个函数调用记录为一个阶段的装饰器"""
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.span(name):
+                return func(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+@contextmanager
+def profile_run(out_dir: str = './log') -> Iterator[Tracer]:
+    """在上下文内开启剖析，退出时写出 trace 与 cProfile 报告
+
+    cProfile 只统计调用本函数的线程；其他线程中的阶段仍会记录到 trace 中。
+    """
+    global _active
+    if _active is not None:
+        # 已在剖析中，嵌套调用直接复用
+        yield _active
+        return
+
+    tracer = Tracer()
+    _active = tracer
+    tracer.profiler.enable()
+    try:
+        with tracer.span('run'):
+            yield tracer
+    finally:
+        tracer.profiler.disable()
+        _active = None
+        paths = tracer.write(out_dir, f"profile_{int(time.time())}")
+        print("\n⏱️ 性能剖析结果 (墙钟 / CPU, 毫秒):")
+        for item in tracer.summary()[:10]:
+            print(f"  {item['name']:<24} x{item['count']:<5} {item['wall_ms']:>12.1f} / {item['cpu_ms']:.1f}")
+        print(f"📁 Trace 已保存到: {paths['trace']}")
+        print(f"📁 cProfile 报告已保存到: {paths['report']}")
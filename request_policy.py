@@ -0,0 +1,316 @@
+"""
+统一的请求策略：限流、重试与熔断
+
+所有 WorldQuant Brain 与 OpenRouter 请求都通过 get_policy(端点).call(...) 发出：
+
+- 令牌桶限流：每个端点一个令牌桶，状态保存在本地文件中并通过文件锁同步，
+  同一台机器上的多个线程、多个进程共享同一份配额
+- 重试：对 429 / 5xx 和网络异常做带抖动的指数退避，优先遵守 Retry-After；
+  非幂等请求（如提交模拟）只在 429 和请求尚未发出的连接错误时重试，避免重复提交
+- 熔断：连续失败达到阈值后短时间内直接拒绝请求，避免在服务异常时浪费模拟配额
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+import openai
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from profiling import span
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+    import msvcrt
+
+# 需要重试的 HTTP 状态码
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 限流状态文件目录，同一台机器上的所有进程共享
+STATE_DIR = os.environ.get(
+    'WORLDQUANT_RATE_LIMIT_DIR',
+    os.path.join(tempfile.gettempdir(), 'worldquant_rate_limits'),
+)
+
+# 最大重试次数，与 env.example 中的 MAX_RETRIES 保持一致
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 3))
+
+# 各端点的默认限流配置: (每秒令牌数, 桶容量)
+DEFAULT_LIMITS = {
+    'authentication': (0.2, 1),
+    'simulations': (1.0, 5),
+    'alphas': (5.0, 10),
+    'chat': (0.5, 2),
+}
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class FileLock:
+    """基于文件的互斥锁，同时对本进程内的线程加锁"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> "FileLock":
+        self._thread_lock.acquire()
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+        except Exception:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        try:
+            if self._fd is not None:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self._thread_lock.release()
+
+
+class TokenBucket:
+    """跨线程、跨进程共享的令牌桶"""
+
+    def __init__(self, name: str, rate: float, capacity: float, state_dir: str = STATE_DIR):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, f"{name}.json")
+        self.lock = FileLock(os.path.join(state_dir, f"{name}.lock"))
+
+    def _read_state(self, now: float) -> Dict[str, float]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'tokens': self.capacity, 'updated': now}
+
+    def _write_state(self, state: Dict[str, float]) -> None:
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def try_acquire(self) -> float:
+        """尝试取出一个令牌；成功返回 0，否则返回需要等待的秒数"""
+        with self.lock:
+            now = time.time()
+            state = self._read_state(now)
+            elapsed = max(0.0, now - state['updated'])
+            tokens = min(self.capacity, state['tokens'] + elapsed * self.rate)
+            if tokens >= 1:
+                self._write_state({'tokens': tokens - 1, 'updated': now})
+                return 0.0
+            self._write_state({'tokens': tokens, 'updated': now})
+            return (1 - tokens) / self.rate
+
+    def acquire(self) -> None:
+        """阻塞直到取得一个令牌（等待期间不持有锁）"""
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def penalize(self, seconds: float) -> None:
+        """收到限流响应后清空令牌，让所有调用方一起等待"""
+        with self.lock:
+            now = time.time()
+            self._write_state({'tokens': -seconds * self.rate, 'updated': now})
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，冷却时间过后放行一次试探请求"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.time() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"{self.name} 服务连续失败，已暂停请求")
+            # 半开状态：放行本次请求，失败则重新计时
+            self._opened_at = time.time()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"⚠️ {self.name} 连续失败 {self._failures} 次，熔断 {self.reset_timeout:.0f} 秒")
+                self._opened_at = time.time()
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After（秒数或 HTTP 日期）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_and_headers(obj: Any) -> Tuple[Optional[int], Mapping[str, str]]:
+    """从 requests 响应或 SDK 异常中取出 (状态码, 响应头)"""
+    status = getattr(obj, 'status_code', None)
+    response = getattr(obj, 'response', None)
+    headers = getattr(obj, 'headers', None)
+    if headers is None and response is not None:
+        headers = getattr(response, 'headers', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return status, headers or {}
+
+
+class RequestPolicy:
+    """单个端点的限流、重试与熔断策略"""
+
+    def __init__(self, name: str, rate: float, capacity: float, max_retries: int = MAX_RETRIES,
+                 base_delay: float = 1.0, max_delay: float = 60.0, state_dir: str = STATE_DIR):
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(name, rate, capacity, state_dir)
+        self.breaker = CircuitBreaker(name)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # 完全抖动的指数退避；有 Retry-After 时以其为下限（超过 max_delay 的由调用方放弃重试）
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    @staticmethod
+    def _not_sent(e: Exception) -> bool:
+        """连接是否在发送请求之前就失败了（连接超时、连接被拒绝、域名解析失败）"""
+        if isinstance(e, requests.ConnectTimeout):
+            return True
+        if not isinstance(e, requests.ConnectionError):
+            return False
+        # requests 把 urllib3 的 MaxRetryError 包在 args[0] 中，reason 才是真正的底层错误；
+        # 域名解析失败 (NameResolutionError) 是 NewConnectionError 的子类
+        reason = e.args[0] if e.args else None
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return isinstance(reason, NewConnectionError)
+
+    @classmethod
+    def _retryable_error(cls, e: Exception, status: Optional[int], idempotent: bool) -> bool:
+        if status is not None:
+            return status in RETRY_STATUS_CODES if idempotent else status == 429
+        if not idempotent:
+            # 连接中途断开、读超时等情况下服务端可能已经收到请求，重试会重复创建资源
+            return cls._not_sent(e)
+        return isinstance(e, (requests.ConnectionError, requests.Timeout, openai.APIConnectionError))
+
+    def call(self, func: Callable[..., Any], *args: Any, idempotent: bool = True, **kwargs: Any) -> Any:
+        """按策略调用 func
+
+        对 requests 响应，状态码为 429/5xx 时重试，重试耗尽后返回最后一次响应，
+        由调用方按原有逻辑处理；异常在重试耗尽后原样抛出。Retry-After 超过 max_delay 时
+        同样不再重试，直接返回响应或抛出异常。
+
+        idempotent=False 用于提交模拟等非幂等请求：只在 429 和连接尚未建立的错误
+        （连接超时、连接被拒绝、域名解析失败）时重试；5xx、读超时和连接中途断开时
+        服务端可能已经处理了请求，直接交给调用方。
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            with span('rate_limit_wait', endpoint=self.name):
+                self.bucket.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                status, headers = _status_and_headers(e)
+                # 429 已由令牌桶处理，不计入熔断；只有 5xx 和连接错误才算服务失败
+                if (status is not None and status >= 500) or (status is None and isinstance(
+                        e, (requests.ConnectionError, requests.Timeout, openai.APIConnectionError))):
+                    self.breaker.record_failure()
+                if not self._retryable_error(e, status, idempotent) or attempt >= self.max_retries:
+                    raise
+                error, outcome = str(e), e
+            else:
+                status, headers = _status_and_headers(result)
+                if status is not None and status >= 500:
+                    self.breaker.record_failure()
+                elif status != 429:
+                    self.breaker.record_success()
+                retryable = status in RETRY_STATUS_CODES if idempotent else status == 429
+                if not retryable or attempt >= self.max_retries:
+                    return result
+                error, outcome = f"HTTP {status}", result
+
+            retry_after = _parse_retry_after(headers.get('Retry-After'))
+            delay = self._backoff(attempt, retry_after)
+            if status == 429:
+                self.bucket.penalize(delay)
+            if retry_after is not None and retry_after > self.max_delay:
+                # 服务端要求等待的时间超过上限：不提前重试，交给调用方处理
+                print(f"⏸️ {self.name} 要求 {retry_after:.0f} 秒后重试，超过上限 {self.max_delay:.0f} 秒，放弃重试")
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+            attempt += 1
+            print(f"🔁 {self.name} 请求失败 ({error})，{delay:.1f} 秒后第 {attempt} 次重试...")
+            with span('backoff', endpoint=self.name):
+                time.sleep(delay)
+
+
+_policies: Dict[str, RequestPolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(name: str) -> RequestPolicy:
+    """获取端点的共享策略实例（authentication / simulations / alphas / chat）"""
+    with _policies_lock:
+        policy = _policies.get(name)
+        if policy is None:
+            rate, capacity = DEFAULT_LIMITS.get(name, (1.0, 1))
+            policy = RequestPolicy(name, rate, capacity)
+            _policies[name] = policy
+        return policy
@@ -0,0 +1,185 @@
+"""
+增量结果汇总与实时排行榜
+
+每得到一个测试结果就调用 ResultAggregator.add()：
+
+- 结果立即以 JSON lines 追加写入磁盘，内存中不保留完整结果列表
+- 用固定大小的最小堆维护按夏普比率排序的前 k 名
+- 以 Welford 算法维护夏普比率、适应度、换手率的运行统计
+- 每次更新时原子写入状态文件，并按固定间隔在终端刷新排行榜
+- 设置 target_sharpe 后，一旦有结果达到目标即可提前停止
+
+内存占用只与 k 有关，与测试数量无关。
+"""
+
+import heapq
+import json
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# 排行榜中保留的字段
+LEADERBOARD_FIELDS = ('alpha_id', 'description', 'expression', 'sharpe', 'fitness', 'turnover', 'returns')
+
+
+def _as_number(value: Any) -> float:
+    """将指标转换为有限浮点数，缺失或无法解析时为 0"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return value if math.isfinite(value) else 0.0
+
+
+def _leaderboard_entry(result: Dict[str, Any], sharpe: float) -> Dict[str, Any]:
+    """精简结果：指标统一为数值，描述与表达式缺失时使用默认值"""
+    entry = {k: result.get(k) for k in LEADERBOARD_FIELDS}
+    for name in ('fitness', 'turnover', 'returns'):
+        entry[name] = _as_number(entry[name])
+    entry['sharpe'] = sharpe
+    entry['description'] = entry['description'] or '未知'
+    entry['expression'] = entry['expression'] or 'N/A'
+    return entry
+
+
+class RunningStats:
+    """Welford 在线均值/方差"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max}
+
+
+class ResultAggregator:
+    """流式汇总测试结果，维护前 k 名与运行统计"""
+
+    def __init__(self, top_k: int = 10, stream_path: Optional[str] = None,
+                 status_path: Optional[str] = None, target_sharpe: Optional[float] = None,
+                 refresh_interval: float = 60.0, timestamp: Optional[int] = None):
+        self.top_k = top_k
+        # 本次运行的时间戳，结果流、状态文件与汇总文件共用同一个，便于对应
+        self.timestamp = int(time.time()) if timestamp is None else timestamp
+        self.stream_path = stream_path
+        self.status_path = status_path
+        self.target_sharpe = target_sharpe
+        self.refresh_interval = refresh_interval
+
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.stats = {name: RunningStats() for name in ('sharpe', 'fitness', 'turnover')}
+        self.started_at = time.time()
+        self.target_reached = False
+
+        # 最小堆: (夏普比率, 序号, 精简结果)；堆顶是当前第 k 名
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._last_refresh = 0.0
+        self._stream = None
+        if stream_path:
+            os.makedirs(os.path.dirname(stream_path) or '.', exist_ok=True)
+            self._stream = open(stream_path, 'a', encoding='utf-8')
+
+    def add(self, result: Dict[str, Any]) -> bool:
+        """加入一个测试结果；返回是否已达到目标夏普比率"""
+        self.total += 1
+        if self._stream is not None:
+            self._stream.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+            self._stream.flush()
+
+        if result.get('status') == 'success':
+            self.succeeded += 1
+            for name, stats in self.stats.items():
+                value = result.get(name)
+                if isinstance(value, (int, float)) and math.isfinite(value):
+                    stats.add(float(value))
+
+            sharpe = _as_number(result.get('sharpe'))
+            entry = (sharpe, self.total, _leaderboard_entry(result, sharpe))
+            if len(self._heap) < self.top_k:
+                heapq.heappush(self._heap, entry)
+            elif sharpe > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+            if self.target_sharpe is not None and sharpe >= self.target_sharpe and not self.target_reached:
+                self.target_reached = True
+                print(f"🎯 已达到目标夏普比率 {self.target_sharpe:.3f}: {result.get('description')} ({sharpe:.3f})")
+        else:
+            self.failed += 1
+
+        self.write_status()
+        if time.time() - self._last_refresh >= self.refresh_interval:
+            self.print_leaderboard(limit=5)
+        return self.target_reached
+
+    def leaderboard(self) -> List[Dict[str, Any]]:
+        """按夏普比率从高到低返回前 k 名"""
+        return [entry[2] for entry in sorted(self._heap, key=lambda e: (-e[0], e[1]))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'updated_at': int(time.time()),
+            'elapsed_sec': round(time.time() - self.started_at, 1),
+            'total': self.total,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'target_sharpe': self.target_sharpe,
+            'target_reached': self.target_reached,
+            'stats': {name: stats.to_dict() for name, stats in self.stats.items()},
+            'leaderboard': self.leaderboard(),
+            'results_file': self.stream_path,
+        }
+
+    def write_status(self) -> None:
+        """原子写入状态文件，供外部随时查看进度"""
+        if not self.status_path:
+            return
+        tmp_path = self.status_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2, ensure_ascii=False, default=str)
+        os.replace(tmp_path, self.status_path)
+
+    def print_leaderboard(self, limit: Optional[int] = None) -> None:
+        """在终端打印当前排行榜"""
+        self._last_refresh = time.time()
+        sharpe = self.stats['sharpe']
+        print(f"\n📈 实时排行榜: 已测试 {self.total} 个, 成功 {self.succeeded} 个, 失败 {self.failed} 个", end='')
+        if sharpe.count:
+            print(f", 平均夏普比率 {sharpe.mean:.3f}, 最高 {sharpe.max:.3f}")
+        else:
+            print()
+        for i, item in enumerate(self.leaderboard()[:limit], 1):
+            print(f"  {i}. {item['sharpe']:.3f}  {item['description']}")
+
+    def close(self) -> None:
+        """写出最终状态并关闭结果流"""
+        self.write_status()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __enter__(self) -> "ResultAggregator":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
@@ -0,0 +1,157 @@
+"""alpha_store 的单元测试：追加写入、重新打开、中断恢复与记录集解析"""
+
+import json
+import time
+import types
+from email.utils import formatdate
+
+import numpy as np
+import pytest
+import requests
+
+import alpha_store
+from alpha_store import PNL_DTYPE, AlphaFetcher, AlphaStore, days_to_date, parse_pnl_recordset
+
+
+def make_records(start: int, pnl) -> np.ndarray:
+    records = np.empty(len(pnl), dtype=PNL_DTYPE)
+    records['date'] = np.arange(start, start + len(pnl))
+    records['pnl'] = pnl
+    return records
+
+
+def test_append_reopen_and_read_back(tmp_path):
+    store = AlphaStore(str(tmp_path))
+    a = make_records(100, [1.0, 2.0, 3.0])
+    b = make_records(101, [10.0, 20.0])
+    store.append('A', a, {'id': 'A', 'settings': {'delay': 1}})
+    store.append('B', b, {'id': 'B'})
+
+    reopened = AlphaStore(str(tmp_path))
+    assert len(reopened) == 2 and 'A' in reopened and 'C' not in reopened
+    np.testing.assert_array_equal(reopened.get_pnl('A'), a)
+    np.testing.assert_array_equal(reopened.get_pnl('B'), b)
+    assert reopened.get_details(['A']) == {'A': {'id': 'A', 'settings': {'delay': 1}}}
+    assert set(reopened.get_details()) == {'A', 'B'}
+
+
+def test_reappend_existing_alpha_uses_latest_records(tmp_path):
+    store = AlphaStore(str(tmp_path))
+    store.append('A', make_records(100, [1.0, 2.0]))
+    store.append('B', make_records(100, [5.0]))
+    updated = make_records(100, [1.0, 2.0, 4.0])
+    store.append('A', updated)
+
+    np.testing.assert_array_equal(store.get_pnl('A'), updated)
+    reopened = AlphaStore(str(tmp_path))
+    assert len(reopened) == 2
+    np.testing.assert_array_equal(reopened.get_pnl('A'), updated)
+    np.testing.assert_array_equal(reopened.get_pnl('B'), make_records(100, [5.0]))
+
+
+def test_recovers_from_half_written_trailing_record(tmp_path):
+    store = AlphaStore(str(tmp_path))
+    a = make_records(100, [1.0, 2.0])
+    store.append('A', a)
+
+    # 模拟写入中断：pnl.bin 末尾留下半条记录，index.jsonl 末尾留下残缺行
+    with open(tmp_path / 'pnl.bin', 'ab') as f:
+        f.write(make_records(0, [9.0]).tobytes()[:PNL_DTYPE.itemsize // 2])
+    with open(tmp_path / 'index.jsonl', 'a', encoding='utf-8') as f:
+        f.write('{"alpha_id": "X", "off')
+
+    reopened = AlphaStore(str(tmp_path))
+    assert 'X' not in reopened
+    b = make_records(200, [3.0, 4.0, 5.0])
+    reopened.append('B', b)
+
+    assert (tmp_path / 'pnl.bin').stat().st_size == (len(a) + len(b)) * PNL_DTYPE.itemsize
+    final = AlphaStore(str(tmp_path))
+    np.testing.assert_array_equal(final.get_pnl('A'), a)
+    np.testing.assert_array_equal(final.get_pnl('B'), b)
+
+
+def test_unindexed_complete_records_are_overwritten(tmp_path):
+    store = AlphaStore(str(tmp_path))
+    store.append('A', make_records(100, [1.0]))
+    # 数据已写入但索引行未写入
+    with open(tmp_path / 'pnl.bin', 'ab') as f:
+        f.write(make_records(0, [7.0, 8.0]).tobytes())
+
+    reopened = AlphaStore(str(tmp_path))
+    reopened.append('B', make_records(300, [2.0]))
+    entries = [json.loads(line) for line in (tmp_path / 'index.jsonl').read_text().splitlines()]
+    assert [e['offset'] for e in entries] == [0, 1]
+    np.testing.assert_array_equal(AlphaStore(str(tmp_path)).get_pnl('B'), make_records(300, [2.0]))
+
+
+def test_pnl_matrix_aligns_dates(tmp_path):
+    store = AlphaStore(str(tmp_path))
+    store.append('A', make_records(100, [1.0, 2.0, 3.0]))
+    store.append('B', make_records(101, [10.0, 20.0, 30.0]))
+
+    dates, matrix = store.pnl_matrix(['A', 'B'])
+    np.testing.assert_array_equal(dates, [100, 101, 102, 103])
+    np.testing.assert_array_equal(matrix, [
+        [1.0, np.nan],
+        [2.0, 10.0],
+        [3.0, 20.0],
+        [np.nan, 30.0],
+    ])
+    dates, matrix = store.pnl_matrix([])
+    assert dates.size == 0 and matrix.shape == (0, 0)
+
+
+def test_correlation_uses_daily_pnl_changes(tmp_path):
+    store = AlphaStore(str(tmp_path))
+    daily = np.array([1.0, -2.0, 3.0, 0.5, -1.0])
+    store.append('A', make_records(0, np.cumsum(daily)))
+    store.append('B', make_records(0, np.cumsum(-2 * daily)))
+    store.append('C', make_records(0, np.cumsum(daily + [0.0, 1.0, 0.0, -1.0, 0.0])))
+
+    corr = store.correlation(['A', 'B', 'C'])
+    assert corr.shape == (3, 3)
+    assert corr[0, 1] == pytest.approx(-1.0)
+    expected = np.corrcoef(np.diff(np.cumsum(daily)), np.diff(store.get_pnl('C')['pnl']))[0, 1]
+    assert corr[0, 2] == pytest.approx(expected)
+
+    store.append('D', make_records(0, [1.0, 2.0]))
+    assert np.isnan(store.correlation(['A', 'D'])).all()
+
+
+def test_parse_pnl_recordset_with_null_values():
+    data = {
+        'schema': {'properties': [{'name': 'pnl'}, {'name': 'date'}]},
+        'records': [[None, '2020-01-02'], [12.5, '2020-01-03'], [None, '2020-01-06']],
+    }
+    records = parse_pnl_recordset(data)
+    assert [days_to_date(d) for d in records['date']] == ['2020-01-02', '2020-01-03', '2020-01-06']
+    np.testing.assert_array_equal(records['pnl'], [np.nan, 12.5, np.nan])
+    assert parse_pnl_recordset({}).size == 0
+
+
+def _response(status: int, body: bytes = b'', headers=None) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = body
+    resp.headers.update(headers or {})
+    return resp
+
+
+def test_fetcher_polls_with_http_date_retry_after(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(alpha_store, 'time', types.SimpleNamespace(time=time.time, sleep=sleeps.append))
+
+    retry_at = formatdate(time.time() + 30, usegmt=True)
+    responses = iter([
+        _response(200, headers={'Retry-After': retry_at}),
+        _response(200, json.dumps({'id': 'A'}).encode()),
+    ])
+    sess = requests.Session()
+    sess.cookies.set('t', 'token')
+    with AlphaFetcher(sess, workers=2) as fetcher:
+        assert fetcher.sess is not sess
+        assert fetcher.sess.cookies.get('t') == 'token'
+        fetcher.sess.get = lambda url: next(responses)
+        assert fetcher._get_json('https://example.invalid/alphas/A', 'fetch') == {'id': 'A'}
+    assert len(sleeps) == 1 and 25 < sleeps[0] <= 30
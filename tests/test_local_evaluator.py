@@ -0,0 +1,353 @@
+"""local_evaluator 的单元测试：解析器、算子（对照暴力实现）、回测指标与进程池"""
+
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_store import PanelStore, build_panel_store
+from local_evaluator import (
+    ExpressionError,
+    LocalFactorEvaluator,
+    compute_metrics,
+    evaluate_expression,
+    evaluate_factor,
+    expression_fields,
+    group_mean,
+    group_neutralize,
+    group_rank,
+    group_zscore,
+    parse_expression,
+    ts_corr,
+    ts_covariance,
+    ts_decay_linear,
+    ts_delay,
+    ts_delta,
+    ts_mean,
+    ts_product,
+    ts_rank,
+    ts_scale,
+    ts_std_dev,
+    ts_sum,
+    ts_zscore,
+)
+
+T, N, D = 30, 12, 5
+
+
+@pytest.fixture
+def x():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(T, N))
+    data[rng.random((T, N)) < 0.1] = np.nan
+    return data
+
+
+@pytest.fixture
+def y():
+    rng = np.random.default_rng(1)
+    data = rng.normal(size=(T, N))
+    data[rng.random((T, N)) < 0.1] = np.nan
+    return data
+
+
+@pytest.fixture
+def groups():
+    codes = np.array([0, 1, 2, 0, 1, 2, 0, 1, 2, 0, 1, -1])
+    assert codes.shape == (N,)
+    return codes
+
+
+def _rolling_reference(x, d, func):
+    """逐点计算窗口 [t-d+1, t] 上的 func(窗口, 当前值)，前 d-1 行为 NaN"""
+    out = np.full(x.shape, np.nan)
+    for t in range(d - 1, x.shape[0]):
+        for j in range(x.shape[1]):
+            out[t, j] = func(x[t - d + 1:t + 1, j], x[t, j])
+    return out
+
+
+# ---------------------------------------------------------------------------
+# 解析器
+# ---------------------------------------------------------------------------
+
+class TestParser:
+    def test_precedence(self):
+        assert parse_expression("1 + 2 * 3") == (
+            "bin", "+", ("num", 1.0), ("bin", "*", ("num", 2.0), ("num", 3.0)))
+        assert parse_expression("(1 + 2) * 3") == (
+            "bin", "*", ("bin", "+", ("num", 1.0), ("num", 2.0)), ("num", 3.0))
+        assert parse_expression("1 - 2 - 3") == (
+            "bin", "-", ("bin", "-", ("num", 1.0), ("num", 2.0)), ("num", 3.0))
+        # ^ 为右结合
+        assert parse_expression("2 ^ 3 ^ 2") == (
+            "bin", "^", ("num", 2.0), ("bin", "^", ("num", 3.0), ("num", 2.0)))
+        assert parse_expression("-close * 2") == (
+            "bin", "*", ("neg", ("field", "close")), ("num", 2.0))
+        assert parse_expression("a < b + 1") == (
+            "bin", "<", ("field", "a"), ("bin", "+", ("field", "b"), ("num", 1.0)))
+
+    def test_ternary(self):
+        assert parse_expression("close > open ? 1 : -1") == (
+            "call", "if_else",
+            [("bin", ">", ("field", "close"), ("field", "open")), ("num", 1.0), ("neg", ("num", 1.0))],
+            {},
+        )
+
+    def test_keyword_arguments(self):
+        assert parse_expression("winsorize(x, std=4)") == (
+            "call", "winsorize", [("field", "x")], {"std": ("num", 4.0)})
+        assert parse_expression("quantile(x, driver = gaussian, sigma=1.5)") == (
+            "call", "quantile", [("field", "x")], {"driver": ("str", "gaussian"), "sigma": ("num", 1.5)})
+        assert parse_expression("add(x, y, filter=false)")[3] == {"filter": ("num", 0.0)}
+
+    def test_expression_fields(self):
+        fields = expression_fields("group_neutralize(ts_corr(rank(open), volume, 10), subindustry)")
+        assert fields == {"open", "volume", "subindustry"}
+
+    @pytest.mark.parametrize("expression", ["-ts_mean((close/open - 1), 20))", "rank(close", "close $ open", ""])
+    def test_invalid_expressions(self, expression):
+        with pytest.raises(ExpressionError):
+            parse_expression(expression)
+
+    def test_unknown_function_and_field(self, x):
+        with pytest.raises(ExpressionError):
+            evaluate_expression("foo(x)", {"x": x})
+        with pytest.raises(ExpressionError):
+            evaluate_expression("rank(close)", {"x": x})
+
+
+# ---------------------------------------------------------------------------
+# 时间序列算子
+# ---------------------------------------------------------------------------
+
+def _valid(w):
+    return w[~np.isnan(w)]
+
+
+class TestTimeSeriesOperators:
+    def test_ts_sum(self, x):
+        ref = _rolling_reference(x, D, lambda w, v: _valid(w).sum() if _valid(w).size else np.nan)
+        np.testing.assert_allclose(ts_sum(x, D), ref, equal_nan=True)
+
+    def test_ts_mean(self, x):
+        ref = _rolling_reference(x, D, lambda w, v: _valid(w).mean() if _valid(w).size else np.nan)
+        np.testing.assert_allclose(ts_mean(x, D), ref, equal_nan=True)
+
+    def test_ts_std_dev(self, x):
+        ref = _rolling_reference(x, D, lambda w, v: _valid(w).std() if _valid(w).size > 1 else np.nan)
+        np.testing.assert_allclose(ts_std_dev(x, D), ref, equal_nan=True, atol=1e-12)
+
+    def test_ts_zscore(self, x):
+        def ref_func(w, v):
+            w = _valid(w)
+            return (v - w.mean()) / w.std() if w.size > 1 else np.nan
+        np.testing.assert_allclose(ts_zscore(x, D), _rolling_reference(x, D, ref_func), equal_nan=True)
+
+    def test_ts_covariance_and_corr(self, x, y):
+        cov_ref = np.full(x.shape, np.nan)
+        corr_ref = np.full(x.shape, np.nan)
+        for t in range(D - 1, T):
+            for j in range(N):
+                a, b = x[t - D + 1:t + 1, j], y[t - D + 1:t + 1, j]
+                mask = ~np.isnan(a) & ~np.isnan(b)
+                a, b = a[mask], b[mask]
+                if a.size > 1:
+                    cov_ref[t, j] = ((a - a.mean()) * (b - b.mean())).mean()
+                    if a.std() > 0 and b.std() > 0:
+                        corr_ref[t, j] = cov_ref[t, j] / (a.std() * b.std())
+        np.testing.assert_allclose(ts_covariance(x, y, D), cov_ref, equal_nan=True, atol=1e-12)
+        np.testing.assert_allclose(ts_corr(x, y, D), corr_ref, equal_nan=True, atol=1e-10)
+
+    def test_ts_delay_and_delta(self, x):
+        ref = np.full(x.shape, np.nan)
+        ref[3:] = x[:-3]
+        np.testing.assert_array_equal(ts_delay(x, 3), ref)
+        np.testing.assert_array_equal(ts_delta(x, 3), x - ref)
+        np.testing.assert_array_equal(ts_delay(x, 0), x)
+
+    def test_ts_delay_negative_raises(self, x):
+        with pytest.raises(ExpressionError):
+            ts_delay(x, -1)
+        with pytest.raises(ExpressionError):
+            evaluate_expression("ts_delay(close, -1)", {"close": x})
+
+    def test_ts_decay_linear(self, x):
+        def ref_func(w, v):
+            weights = np.arange(1, D + 1, dtype=float)  # 最新一天权重为 D
+            mask = ~np.isnan(w)
+            return (w[mask] * weights[mask]).sum() / weights[mask].sum() if mask.any() else np.nan
+        np.testing.assert_allclose(ts_decay_linear(x, D), _rolling_reference(x, D, ref_func), equal_nan=True)
+
+    def test_ts_rank(self, x):
+        def ref_func(w, v):
+            if np.isnan(v):
+                return np.nan
+            w = _valid(w)
+            return (w < v).sum() / (w.size - 1) if w.size > 1 else np.nan
+        np.testing.assert_allclose(ts_rank(x, D), _rolling_reference(x, D, ref_func), equal_nan=True)
+
+    def test_ts_product(self, x):
+        ref = _rolling_reference(x, D, lambda w, v: np.prod(w))
+        np.testing.assert_allclose(ts_product(x, D), ref, equal_nan=True)
+
+    def test_ts_scale(self, x):
+        def ref_func(w, v):
+            w = _valid(w)
+            if not w.size or w.max() == w.min():
+                return np.nan
+            return (v - w.min()) / (w.max() - w.min())
+        np.testing.assert_allclose(ts_scale(x, D), _rolling_reference(x, D, ref_func), equal_nan=True)
+
+    def test_invalid_window_raises(self, x):
+        with pytest.raises(ExpressionError):
+            ts_mean(x, 0)
+
+
+# ---------------------------------------------------------------------------
+# 分组算子
+# ---------------------------------------------------------------------------
+
+def _group_reference(x, groups, func):
+    """逐日、逐组调用 func(组内值, 组内权重下标)，返回与 x 同形状的结果"""
+    out = np.full(x.shape, np.nan)
+    for t in range(x.shape[0]):
+        for g in set(groups.tolist()) - {-1}:
+            members = np.flatnonzero((groups == g) & ~np.isnan(x[t]))
+            if members.size:
+                out[t, members] = func(t, members)
+    return out
+
+
+class TestGroupOperators:
+    def test_group_mean(self, x, y, groups):
+        weight = np.abs(y)
+
+        def ref_func(t, members):
+            w = weight[t, members]
+            mask = ~np.isnan(w)
+            return (x[t, members][mask] * w[mask]).sum() / w[mask].sum() if mask.any() else np.nan
+
+        out = group_mean(x, weight, groups)
+        ref = _group_reference(x, groups, ref_func)
+        valid = ~np.isnan(x)
+        np.testing.assert_allclose(out[valid], ref[valid], equal_nan=True)
+
+    def test_group_neutralize(self, x, groups):
+        ref = _group_reference(x, groups, lambda t, m: x[t, m] - x[t, m].mean())
+        np.testing.assert_allclose(group_neutralize(x, groups), ref, equal_nan=True, atol=1e-12)
+
+    def test_group_zscore(self, x, groups):
+        ref = _group_reference(x, groups, lambda t, m: (x[t, m] - x[t, m].mean()) / x[t, m].std())
+        np.testing.assert_allclose(group_zscore(x, groups), ref, equal_nan=True, atol=1e-12)
+
+    def test_group_rank(self, x, groups):
+        def ref_func(t, members):
+            values = x[t, members]
+            if values.size == 1:
+                return 0.5
+            return np.argsort(np.argsort(values)) / (values.size - 1)
+        np.testing.assert_allclose(group_rank(x, groups), _group_reference(x, groups, ref_func), equal_nan=True)
+
+
+# ---------------------------------------------------------------------------
+# 回测指标
+# ---------------------------------------------------------------------------
+
+class TestComputeMetrics:
+    def test_known_pnl(self):
+        # 两只股票恒定多空 (+0.5, -0.5)，两者收益率互为相反数，每日 PnL 恰为 a_t
+        a = np.array([0.0, 0.01, -0.02, 0.03, 0.005, -0.01, 0.02])
+        alpha = np.tile([1.0, -1.0], (len(a), 1))
+        returns = np.stack([a, -a], axis=1)
+        metrics = compute_metrics(alpha, returns)
+
+        pnl = a[1:]
+        sharpe = pnl.mean() / pnl.std() * math.sqrt(252)
+        assert metrics["sharpe"] == pytest.approx(sharpe)
+        assert metrics["returns"] == pytest.approx(pnl.mean() * 252)
+        assert metrics["turnover"] == pytest.approx(0.0)
+        assert metrics["fitness"] == pytest.approx(sharpe * math.sqrt(abs(pnl.mean() * 252) / 0.125))
+
+    def test_turnover_of_flipping_positions(self):
+        alpha = np.array([[1.0, -1.0], [-1.0, 1.0]] * 5)
+        metrics = compute_metrics(alpha, np.zeros_like(alpha))
+        # 每天从 (+0.5, -0.5) 翻到 (-0.5, +0.5)，换手率为 2
+        assert metrics["turnover"] == pytest.approx(2.0)
+        assert metrics["sharpe"] == 0.0
+
+    def test_no_positions(self):
+        alpha = np.full((10, 3), np.nan)
+        assert compute_metrics(alpha, np.zeros((10, 3))) == {
+            "sharpe": 0.0, "turnover": 0.0, "fitness": 0.0, "returns": 0.0}
+
+
+# ---------------------------------------------------------------------------
+# 进程池
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def panels():
+    rng = np.random.default_rng(2)
+    close = (100 * np.exp(np.cumsum(rng.normal(0, 0.02, (60, 20)), axis=0))).astype(np.float32)
+    open_ = (close * (1 + rng.normal(0, 0.005, close.shape))).astype(np.float32)
+    volume = rng.lognormal(10, 1, close.shape).astype(np.float32)
+    subindustry = rng.integers(0, 4, 20).astype(np.int32)
+    return {"close": close, "open": open_, "volume": volume, "subindustry": subindustry}
+
+
+EXPRESSIONS = [
+    "-ts_mean((close/open - 1), 5)",
+    "(-1 * ts_corr(rank(open), rank(volume), 10))",
+    "group_neutralize(ts_zscore(close, 10), subindustry)",
+    "close > open ? 1 : -1",
+    "rank(close",
+    "foo(close)",
+]
+
+
+def _check_round_trip(results, panels):
+    assert [r["expression"] for r in results] == EXPRESSIONS
+    for result in results:
+        try:
+            expected = evaluate_factor(result["expression"], panels)
+        except ExpressionError:
+            assert result["status"] == "error"
+            continue
+        assert result["status"] == "success"
+        for key in ("sharpe", "turnover", "fitness"):
+            assert result[key] == pytest.approx(expected[key], rel=1e-4, abs=1e-9)
+
+
+def test_evaluator_round_trip(panels):
+    with LocalFactorEvaluator(panels, workers=2, batch_size=2) as evaluator:
+        _check_round_trip(evaluator.evaluate(EXPRESSIONS), panels)
+        # 进程池在多次调用之间复用
+        assert evaluator.evaluate([]) == []
+        assert len(evaluator.evaluate(EXPRESSIONS[:2])) == 2
+
+
+def test_evaluator_round_trip_with_panel_store(panels, tmp_path):
+    dates = pd.bdate_range("2020-01-01", periods=panels["close"].shape[0])
+    instruments = [f"S{i:02d}" for i in range(panels["close"].shape[1])]
+    index = pd.MultiIndex.from_product([dates, instruments], names=["date", "instrument"])
+    frame = pd.DataFrame({
+        name: panels[name].ravel() for name in ("close", "open", "volume")
+    }, index=index)
+    frame["subindustry"] = np.tile(panels["subindustry"], len(dates))
+    store = build_panel_store(str(tmp_path), frame.reset_index())
+    assert "returns" not in store
+
+    with LocalFactorEvaluator(store, workers=2) as evaluator:
+        _check_round_trip(evaluator.evaluate(EXPRESSIONS), store)
+    # 收益率放在共享内存中，存储本身保持只读
+    assert "returns" not in PanelStore(str(tmp_path))
+    assert not (tmp_path / "returns.bin").exists()
+
+
+def test_evaluator_rejects_use_after_close(panels):
+    evaluator = LocalFactorEvaluator(panels, workers=1)
+    evaluator.close()
+    with pytest.raises(RuntimeError):
+        evaluator.evaluate(EXPRESSIONS[:1])
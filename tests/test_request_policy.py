@@ -0,0 +1,299 @@
+"""request_policy 的单元测试：重试、幂等性、熔断与共享令牌桶"""
+
+import socket
+import threading
+
+import pytest
+import requests
+
+import request_policy
+from request_policy import CircuitBreaker, CircuitOpenError, RequestPolicy, TokenBucket
+
+
+class FakeClock:
+    """替换 request_policy 中的 time 模块：sleep 只推进虚拟时钟"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        # 真实的 sleep 至少会让时钟前进一点，避免浮点误差导致令牌桶无限等待极短的时间
+        self.now += max(seconds, 1e-3)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(request_policy, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def policy(tmp_path, clock):
+    return RequestPolicy('test', rate=100.0, capacity=100, max_retries=3,
+                         base_delay=0.1, max_delay=60.0, state_dir=str(tmp_path))
+
+
+def make_response(status: int, headers=None) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers.update(headers or {})
+    return resp
+
+
+class Sequence:
+    """依次返回（或抛出）预设结果，并记录调用次数"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+# ---------------------------------------------------------------------------
+# 429 与 Retry-After
+# ---------------------------------------------------------------------------
+
+def test_429_honours_retry_after(policy, clock):
+    func = Sequence(make_response(429, {'Retry-After': '30'}), make_response(200))
+    assert policy.call(func).status_code == 200
+    assert func.calls == 2
+    backoff = [s for s in clock.sleeps if s >= 30]
+    assert backoff and 30 <= backoff[0] <= 30 + policy.base_delay
+    # 429 不计入熔断
+    assert policy.breaker._failures == 0
+
+
+def test_429_retry_after_above_max_delay_is_not_retried_early(policy, clock):
+    func = Sequence(make_response(429, {'Retry-After': '120'}), make_response(200))
+    assert policy.call(func).status_code == 429
+    assert func.calls == 1
+    assert clock.sleeps == []
+    # 共享令牌桶被清空至少 Retry-After 秒
+    assert policy.bucket.try_acquire() >= 120
+
+
+def test_repeated_429_does_not_open_breaker(policy):
+    for _ in range(policy.breaker.failure_threshold + 1):
+        assert policy.call(Sequence(make_response(429, {'Retry-After': '0'}))).status_code == 429
+    policy.breaker.before_call()
+
+
+# ---------------------------------------------------------------------------
+# 5xx：幂等与非幂等
+# ---------------------------------------------------------------------------
+
+def test_5xx_is_retried_for_idempotent_calls(policy):
+    func = Sequence(make_response(503), make_response(502), make_response(200))
+    assert policy.call(func).status_code == 200
+    assert func.calls == 3
+
+
+def test_5xx_returns_last_response_when_retries_exhausted(policy):
+    func = Sequence(make_response(500))
+    assert policy.call(func).status_code == 500
+    assert func.calls == policy.max_retries + 1
+
+
+def test_5xx_is_not_retried_for_non_idempotent_calls(policy, clock):
+    func = Sequence(make_response(503), make_response(201))
+    assert policy.call(func, idempotent=False).status_code == 503
+    assert func.calls == 1
+
+
+def test_429_is_retried_for_non_idempotent_calls(policy):
+    func = Sequence(make_response(429, {'Retry-After': '1'}), make_response(201))
+    assert policy.call(func, idempotent=False).status_code == 201
+    assert func.calls == 2
+
+
+def test_read_timeout_is_not_retried_for_non_idempotent_calls(policy):
+    func = Sequence(requests.ReadTimeout('read timed out'), make_response(201))
+    with pytest.raises(requests.ReadTimeout):
+        policy.call(func, idempotent=False)
+    assert func.calls == 1
+
+
+def test_non_retryable_errors_are_raised_immediately(policy):
+    func = Sequence(ValueError('bad'))
+    with pytest.raises(ValueError):
+        policy.call(func)
+    assert func.calls == 1
+    assert policy.breaker._failures == 0
+
+
+# ---------------------------------------------------------------------------
+# 真实连接：请求发出后断开 vs 连接被拒绝
+# ---------------------------------------------------------------------------
+
+class DisconnectingServer:
+    """读完整个 HTTP 请求后直接关闭连接，不返回任何响应"""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.sock.settimeout(0.1)
+        self.received = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.sock.getsockname()[1]}/simulations"
+
+    def _serve(self) -> None:
+        while not self._stop:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            conn.settimeout(5)
+            with conn:
+                data = b''
+                while b'\r\n\r\n' not in data:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                head, _, body = data.partition(b'\r\n\r\n')
+                length = 0
+                for line in head.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':')[1])
+                while len(body) < length:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    body += chunk
+                if body:
+                    self.received += 1
+
+    def close(self) -> None:
+        self._stop = True
+        self.sock.close()
+        self._thread.join(timeout=5)
+
+
+@pytest.fixture
+def server():
+    server = DisconnectingServer()
+    yield server
+    server.close()
+
+
+def test_disconnect_after_send_is_not_retried_for_non_idempotent_calls(policy, server):
+    with requests.Session() as sess:
+        with pytest.raises(requests.ConnectionError):
+            policy.call(sess.post, server.url, json={'regular': 'rank(close)'}, idempotent=False)
+    assert server.received == 1
+
+
+def test_disconnect_after_send_is_retried_for_idempotent_calls(policy, server):
+    with requests.Session() as sess:
+        with pytest.raises(requests.ConnectionError):
+            policy.call(sess.post, server.url, json={'regular': 'rank(close)'})
+    assert server.received == policy.max_retries + 1
+
+
+def test_connection_refused_is_retried_for_non_idempotent_calls(policy):
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    calls = []
+
+    def post():
+        calls.append(1)
+        return requests.post(f"http://127.0.0.1:{port}/simulations", json={}, timeout=5)
+
+    with pytest.raises(requests.ConnectionError):
+        policy.call(post, idempotent=False)
+    assert len(calls) == policy.max_retries + 1
+
+
+# ---------------------------------------------------------------------------
+# 熔断
+# ---------------------------------------------------------------------------
+
+def test_breaker_opens_and_recovers_after_reset_timeout(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # 冷却结束后放行一次试探请求；试探失败则重新熔断
+    clock.now += 61
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # 再次冷却后试探成功，熔断器关闭
+    clock.now += 61
+    breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()
+
+
+def test_policy_rejects_calls_while_breaker_is_open(policy):
+    threshold = policy.breaker.failure_threshold
+    func = Sequence(make_response(503))
+    # 第一次调用重试耗尽，失败次数尚未达到阈值
+    assert policy.call(func).status_code == 503
+    assert func.calls == policy.max_retries + 1 < threshold
+    # 第二次调用中途达到阈值，后续重试被熔断拒绝
+    with pytest.raises(CircuitOpenError):
+        policy.call(func)
+    assert func.calls == threshold
+    # 熔断期间不再发出请求
+    with pytest.raises(CircuitOpenError):
+        policy.call(func)
+    assert func.calls == threshold
+
+
+# ---------------------------------------------------------------------------
+# 令牌桶
+# ---------------------------------------------------------------------------
+
+def test_bucket_is_shared_across_instances(tmp_path, clock):
+    first = TokenBucket('shared', rate=1.0, capacity=2, state_dir=str(tmp_path))
+    second = TokenBucket('shared', rate=1.0, capacity=2, state_dir=str(tmp_path))
+
+    assert first.try_acquire() == 0
+    assert second.try_acquire() == 0
+    assert first.try_acquire() == pytest.approx(1.0)
+    assert second.try_acquire() == pytest.approx(1.0)
+
+    clock.now += 1
+    assert second.try_acquire() == 0
+    assert first.try_acquire() == pytest.approx(1.0)
+
+
+def test_bucket_penalty_is_shared_across_instances(tmp_path, clock):
+    first = TokenBucket('shared', rate=1.0, capacity=5, state_dir=str(tmp_path))
+    second = TokenBucket('shared', rate=1.0, capacity=5, state_dir=str(tmp_path))
+
+    first.penalize(10)
+    assert second.try_acquire() == pytest.approx(11.0)
+    second.acquire()
+    assert clock.sleeps == [pytest.approx(11.0)]
@@ -0,0 +1,61 @@
+"""result_aggregator 的单元测试：排行榜、运行统计与状态文件"""
+
+import json
+import statistics
+
+import pytest
+
+from result_aggregator import ResultAggregator
+
+
+def success(sharpe, description=None, **extra):
+    result = {'status': 'success', 'sharpe': sharpe, 'fitness': 1.0, 'turnover': 0.3,
+              'expression': f"rank(x{sharpe})", 'alpha_id': f"A{sharpe}"}
+    if description is not None:
+        result['description'] = description
+    result.update(extra)
+    return result
+
+
+def test_leaderboard_keeps_top_k_in_order():
+    aggregator = ResultAggregator(top_k=3, refresh_interval=1e9)
+    for sharpe in [0.5, 2.0, -1.0, 1.5, 0.9, 1.8]:
+        aggregator.add(success(sharpe, f"s{sharpe}"))
+    aggregator.add({'status': 'failed', 'error': 'x'})
+
+    assert [item['sharpe'] for item in aggregator.leaderboard()] == [2.0, 1.8, 1.5]
+    assert aggregator.total == 7 and aggregator.succeeded == 6 and aggregator.failed == 1
+    stats = aggregator.stats['sharpe']
+    values = [0.5, 2.0, -1.0, 1.5, 0.9, 1.8]
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.std == pytest.approx(statistics.stdev(values))
+
+
+def test_missing_metrics_and_description_do_not_break_leaderboard(capsys):
+    aggregator = ResultAggregator(top_k=3, refresh_interval=1e9)
+    aggregator.add(success(None, fitness=None, expression=None))
+    aggregator.add(success('nan'))
+    aggregator.add(success(1.2, 'ok'))
+
+    board = aggregator.leaderboard()
+    assert board[0]['description'] == 'ok'
+    assert board[1] == {**board[1], 'sharpe': 0.0, 'description': '未知'}
+    assert board[1]['fitness'] == 0.0 and board[1]['expression'] == 'N/A'
+    assert board[2]['sharpe'] == 0.0
+
+    aggregator.print_leaderboard()
+    assert '0.000  未知' in capsys.readouterr().out
+
+
+def test_target_sharpe_and_status_file(tmp_path):
+    status_path = tmp_path / 'status.json'
+    stream_path = tmp_path / 'result.jsonl'
+    with ResultAggregator(stream_path=str(stream_path), status_path=str(status_path),
+                          target_sharpe=1.5, refresh_interval=1e9, timestamp=123) as aggregator:
+        assert aggregator.add(success(1.0)) is False
+        assert aggregator.add(success(1.6)) is True
+        assert aggregator.timestamp == 123
+
+    status = json.loads(status_path.read_text(encoding='utf-8'))
+    assert status['target_reached'] is True and status['total'] == 2
+    assert [json.loads(line)['sharpe'] for line in stream_path.read_text().splitlines()] == [1.0, 1.6]